@@ -0,0 +1,218 @@
+# In-process Bloom filter of account numbers for Code Yatra Bank
+#
+# Answers "is this definitely not an account?" without loading the user, and
+# gives freshly generated account numbers a cheap uniqueness pre-check.
+# A "maybe" answer still has to be confirmed against the users collection.
+#
+# The filter is built at startup from a projected cursor over users and updated
+# by User.save and the bulk importer, so this process's own accounts are never
+# missed. Accounts created by other processes are picked up by a catch-up query
+# over recent _ids, which a miss runs at most once per SYNC_INTERVAL_MS; other
+# misses are answered from the filter alone, without touching the database. A
+# miss can therefore be wrong for an account another process created within
+# that interval, which callers must tolerate (a new account number that
+# collides is retried on DuplicateKeyError). Bloom filters cannot delete, so
+# deleted accounts stay "maybe" until enough deletes trigger a rebuild.
+# Rebuilds triggered by add and remove run on a background thread, off the
+# request path.
+
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+
+import numpy as np
+from bson import ObjectId
+
+from db import mongo
+
+FALSE_POSITIVE_RATE = 0.001
+MIN_CAPACITY = 100000
+GROWTH = 2  # Rebuilt filters have room for this many times the current accounts
+SETTLE_SECONDS = 5  # Catch-up queries overlap by this much so late commits are not missed
+SYNC_INTERVAL_MS = 1000  # Misses run at most one catch-up query per interval
+REBUILD_DELETED_FRACTION = 0.05
+BATCH_SIZE = 50000
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings, sized for `capacity` items at `fp_rate`"""
+
+    def __init__(self, capacity, fp_rate=FALSE_POSITIVE_RATE):
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.size = max(int(math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)), 8)
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, item):
+        # Double hashing: k positions from two 32-bit halves of one digest. The sums stay
+        # below 2**64, so update() computes the same positions in NumPy without wraparound.
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=8).digest()
+        h1 = int.from_bytes(digest[:4], 'little')
+        h2 = int.from_bytes(digest[4:], 'little') | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, item):
+        positions = self._positions(item)
+        bits = self.bits
+        # Setting a bit is a read-modify-write of its byte, so concurrent adds are serialized
+        with self._lock:
+            for p in positions:
+                bits[p >> 3] |= 1 << (p & 7)
+            self.count += 1
+
+    def update(self, items, chunk_size=100000):
+        """Add many items, hashing in chunks and setting bits with NumPy (used for bulk loads)"""
+        packed = np.zeros(len(self.bits), dtype=np.uint8)
+        steps = np.arange(self.hashes, dtype=np.uint64)
+        added = 0
+        items = iter(items)
+        while True:
+            chunk = list(islice(items, chunk_size))
+            if not chunk:
+                break
+            digests = b''.join(hashlib.blake2b(item.encode('utf-8'), digest_size=8).digest() for item in chunk)
+            halves = np.frombuffer(digests, dtype='<u4').reshape(-1, 2).astype(np.uint64)
+            h1 = halves[:, :1]
+            h2 = halves[:, 1:] | np.uint64(1)
+            positions = ((h1 + steps * h2) % np.uint64(self.size)).ravel()
+            # Set bits in place in a filter-sized byte array, rather than one bool per bit
+            np.bitwise_or.at(packed, (positions >> np.uint64(3)).astype(np.intp), np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+            added += len(chunk)
+        with self._lock:
+            merged = np.frombuffer(self.bits, dtype=np.uint8) | packed
+            self.bits[:] = merged.tobytes()
+            self.count += added
+
+    def __contains__(self, item):
+        bits = self.bits
+        for p in self._positions(item):
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def expected_fp_rate(self):
+        """False-positive rate predicted for the items added so far"""
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+    def stats(self):
+        return {
+            'items': self.count,
+            'capacity': self.capacity,
+            'bits': self.size,
+            'hashes': self.hashes,
+            'memory_bytes': len(self.bits),
+            'bits_per_item': round(self.size / max(self.count, 1), 2),
+            'expected_fp_rate': self.expected_fp_rate()
+        }
+
+
+class AccountFilter:
+    """Account-number Bloom filter kept in step with the users collection"""
+
+    def __init__(self):
+        self.bloom = None  # None until built: every lookup is a "maybe"
+        self.deleted = 0
+        self.last_sync = 0.0
+        self.rebuilding = False
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def rebuild(self):
+        """Build a fresh filter from all account numbers. Returns the number loaded."""
+        started = time.time()
+        capacity = max(mongo.db.users.estimated_document_count() * GROWTH, MIN_CAPACITY)
+        bloom = BloomFilter(capacity)
+        cursor = mongo.db.users.find({}, projection={'_id': 0, 'account_no': 1}, batch_size=BATCH_SIZE)
+        bloom.update(user['account_no'] for user in cursor)
+        with self._lock:
+            self.bloom = bloom
+            self.deleted = 0
+            # Accounts created while the cursor ran are caught up by the next miss
+            self.last_sync = started
+        return bloom.count
+
+    def _rebuild_in_background(self):
+        with self._lock:
+            if self.rebuilding:
+                return
+            self.rebuilding = True
+
+        def run():
+            try:
+                self.rebuild()
+            finally:
+                self.rebuilding = False
+        threading.Thread(target=run, name='account-filter-rebuild', daemon=True).start()
+
+    def _sync(self, now):
+        """Add accounts inserted since the last sync, possibly by other processes, if it is due"""
+        if (now - self.last_sync) * 1000 < SYNC_INTERVAL_MS:
+            return
+        # Concurrent misses do not wait for a sync already running; they answer from the filter
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            if (now - self.last_sync) * 1000 < SYNC_INTERVAL_MS:
+                return
+            started = time.time()
+            since = ObjectId.from_datetime(datetime.utcfromtimestamp(self.last_sync) - timedelta(seconds=SETTLE_SECONDS))
+            bloom = self.bloom
+            for user in mongo.db.users.find({'_id': {'$gte': since}}, projection={'_id': 0, 'account_no': 1}):
+                # The window overlaps the previous one and this process's own adds; count each account once
+                if user['account_no'] not in bloom:
+                    bloom.add(user['account_no'])
+            self.last_sync = started
+        finally:
+            self._sync_lock.release()
+
+    def add(self, account_no):
+        bloom = self.bloom
+        if bloom is None:
+            return
+        bloom.add(account_no)
+        if bloom.count > bloom.capacity:
+            # Past capacity the false-positive rate climbs quickly
+            self._rebuild_in_background()
+
+    def remove(self, account_no):
+        """Note a deleted account. It stays a false positive until the next rebuild."""
+        bloom = self.bloom
+        if bloom is None:
+            return
+        self.deleted += 1
+        if self.deleted > bloom.count * REBUILD_DELETED_FRACTION:
+            self._rebuild_in_background()
+
+    def might_exist(self, account_no):
+        """False only if the account number is definitely not in use"""
+        bloom = self.bloom
+        if bloom is None or account_no in bloom:
+            return True
+        # The miss may be an account another process created since the last sync
+        self._sync(time.time())
+        # A rebuild may have swapped filters meanwhile; the sync went into one of the two
+        return account_no in bloom or account_no in self.bloom
+
+    def stats(self):
+        if self.bloom is None:
+            return None
+        stats = self.bloom.stats()
+        stats['deleted'] = self.deleted
+        return stats
+
+
+accounts = AccountFilter()
+
+
+if __name__ == '__main__':
+    from app import app
+    with app.app_context():
+        for key, value in accounts.stats().items():
+            print(f"{key}: {value}")
@@ -0,0 +1,233 @@
+# Transaction analytics for Code Yatra Bank
+#
+# Materialized views, refreshed incrementally with aggregation $merge:
+#   analytics_daily     _id {date, method, type, status} -> count, amount
+#   analytics_accounts  _id account_no -> sent/received amount and count, volume
+# Each view keeps a watermark (the last transaction _id folded in) in
+# analytics_watermarks, and a refresh only aggregates the window of entries
+# after it, adding the totals onto the view documents. Every document records
+# the window it last absorbed, and a window's bounds are saved before it is
+# merged. A refresh that dies part way is retried with the same window, and the
+# merge skips the documents that already absorbed it, so nothing is counted
+# twice. The watermark document doubles as a lease: one refresh per view at a
+# time, across processes.
+#
+# Views are refreshed outside the web requests, from the command line or a
+# worker: python analytics.py refresh [--watch]
+
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
+
+import ledger_router
+from db import mongo
+
+# Entries younger than this are left for the next refresh, so that a write
+# whose _id was generated slightly earlier but committed later is not skipped
+SETTLE_SECONDS = 5
+# Seconds between refreshes with --watch
+REFRESH_INTERVAL = 30
+# A refresh that dies holding a view's lease is taken over after this
+LEASE_SECONDS = 600
+TOP_ACCOUNTS = 10
+NON_ACCOUNTS = ('admin',)
+
+
+def ensure_indexes():
+    mongo.db.analytics_daily.create_index([('_id.date', ASCENDING)])
+    mongo.db.analytics_accounts.create_index([('volume', DESCENDING)])
+
+
+def _acquire(view, now):
+    """Lease a view's watermark document. Returns its previous state, or None if another refresh holds it."""
+    lease_id = ObjectId()
+    try:
+        mark = mongo.db.analytics_watermarks.find_one_and_update(
+            {'_id': view, '$or': [{'locked_until': None}, {'locked_until': {'$lt': now}}]},
+            {'$set': {'lease_id': lease_id, 'locked_until': now + timedelta(seconds=LEASE_SECONDS)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # The document exists and is leased, so the upsert tried to insert a second one
+        return None
+    mark = mark or {}
+    mark['lease_id'] = lease_id
+    return mark
+
+
+def _begin(view, lease_id, upper):
+    """Save the window's upper bound before merging, so a retry after a crash reuses it"""
+    mongo.db.analytics_watermarks.update_one({'_id': view, 'lease_id': lease_id}, {'$set': {'pending_upper': upper}})
+
+
+def _release(view, lease_id, last_id=None):
+    """Drop the lease, advancing the watermark to last_id if given, unless the lease was taken over"""
+    update = {'$set': {'locked_until': None}, '$unset': {'lease_id': ''}}
+    if last_id is not None:
+        update['$set'].update(last_id=last_id, updated_at=datetime.utcnow())
+        update['$unset']['pending_upper'] = ''
+    mongo.db.analytics_watermarks.update_one({'_id': view, 'lease_id': lease_id}, update)
+
+
+def _window_pipeline(lower, upper, stages):
+    """Entries with lower < _id <= upper from every ledger partition, combined with $unionWith"""
+    router = ledger_router.router
+    id_range = {'$lte': upper}
+    if lower is not None:
+        id_range['$gt'] = lower
+    # Mirror copies in a partitioned ledger would count an entry twice
+    match = {'$match': router.primary_query({'_id': id_range})}
+    pipeline = [match]
+    for collection in router.collections[1:]:
+        pipeline.append({'$unionWith': {'coll': collection.name, 'pipeline': [match]}})
+    return pipeline + stages
+
+
+def _aggregate_ledger(pipeline):
+    # One pipeline over all partitions, so each view document gets one merge per window
+    ledger_router.router.collections[0].aggregate(pipeline, allowDiskUse=True)
+
+
+def _merge_window(into, upper, fields):
+    """Stages that add a window's totals onto the view documents that have not absorbed it yet"""
+    added = {field: {'$add': [{'$ifNull': [f'${field}', 0]}, f'$$new.{field}']} for field in fields}
+    added['window'] = '$$new.window'
+    return [
+        {'$set': {'window': upper}},
+        {'$merge': {
+            'into': into,
+            'on': '_id',
+            # Windows only move forward, so a document at or past this one already has its totals
+            'whenMatched': [{'$replaceWith': {'$cond': [
+                {'$gte': ['$window', '$$new.window']},
+                '$$ROOT',
+                {'$mergeObjects': ['$$ROOT', added]}
+            ]}}],
+            'whenNotMatched': 'insert'
+        }}
+    ]
+
+
+def _refresh_daily(lower, upper):
+    _aggregate_ledger(_window_pipeline(lower, upper, [
+        {'$group': {
+            '_id': {
+                'date': '$transaction_time.date',
+                'method': '$method',
+                'type': '$type',
+                'status': '$status'
+            },
+            'count': {'$sum': 1},
+            'amount': {'$sum': '$amount'}
+        }}
+    ] + _merge_window('analytics_daily', upper, ['count', 'amount'])))
+
+
+def _refresh_accounts(lower, upper):
+    # One document per (account, side) so both sender and receiver are credited in one pass
+    _aggregate_ledger(_window_pipeline(lower, upper, [
+        {'$match': {'status': 'success'}},
+        {'$project': {'sides': [
+            {'account': '$sender_account', 'sent_amount': '$amount', 'sent_count': {'$literal': 1}, 'received_amount': {'$literal': 0}, 'received_count': {'$literal': 0}},
+            {'account': '$receiver_account', 'sent_amount': {'$literal': 0}, 'sent_count': {'$literal': 0}, 'received_amount': '$amount', 'received_count': {'$literal': 1}}
+        ], 'amount': 1}},
+        {'$unwind': '$sides'},
+        {'$match': {'sides.account': {'$nin': list(NON_ACCOUNTS)}}},
+        {'$group': {
+            '_id': '$sides.account',
+            'sent_amount': {'$sum': '$sides.sent_amount'},
+            'sent_count': {'$sum': '$sides.sent_count'},
+            'received_amount': {'$sum': '$sides.received_amount'},
+            'received_count': {'$sum': '$sides.received_count'},
+            'volume': {'$sum': '$amount'}
+        }}
+    ] + _merge_window('analytics_accounts', upper, ['sent_amount', 'sent_count', 'received_amount', 'received_count', 'volume'])))
+
+
+VIEWS = (('daily', _refresh_daily), ('accounts', _refresh_accounts))
+
+
+def refresh():
+    """Fold transactions newer than each view's watermark into the views. Returns whether any view changed."""
+    now = datetime.utcnow()
+    latest = ObjectId.from_datetime(now - timedelta(seconds=SETTLE_SECONDS))
+    refreshed = False
+    for view, merge in VIEWS:
+        mark = _acquire(view, now)
+        if mark is None:
+            continue  # Another process is refreshing this view
+        lease_id, lower = mark['lease_id'], mark.get('last_id')
+        # A window left unfinished by a crashed refresh is replayed exactly
+        upper = mark.get('pending_upper') or latest
+        if lower is not None and lower >= upper:
+            _release(view, lease_id)
+            continue
+        _begin(view, lease_id, upper)
+        try:
+            merge(lower, upper)
+        except Exception:
+            _release(view, lease_id)
+            raise
+        _release(view, lease_id, upper)
+        refreshed = True
+    return refreshed
+
+
+def _breakdown(since, field):
+    return list(mongo.db.analytics_daily.aggregate([
+        {'$match': {'_id.date': {'$gte': since}}},
+        {'$group': {'_id': f'$_id.{field}', 'count': {'$sum': '$count'}, 'amount': {'$sum': '$amount'}}},
+        {'$sort': {'amount': -1}}
+    ]))
+
+
+def summary(days=365):
+    """Everything the analytics page shows, read from the materialized views only"""
+    since = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d')
+    daily = list(mongo.db.analytics_daily.aggregate([
+        {'$match': {'_id.date': {'$gte': since}}},
+        {'$group': {'_id': '$_id.date', 'count': {'$sum': '$count'}, 'amount': {'$sum': '$amount'}}},
+        {'$sort': {'_id': 1}}
+    ]))
+    top_accounts = list(mongo.db.analytics_accounts.find().sort('volume', DESCENDING).limit(TOP_ACCOUNTS))
+    return {
+        'since': since,
+        'daily': [{'date': d['_id'], 'count': d['count'], 'amount': round(d['amount'], 2)} for d in daily],
+        'by_method': [{'method': d['_id'], 'count': d['count'], 'amount': round(d['amount'], 2)} for d in _breakdown(since, 'method')],
+        'by_type': [{'type': d['_id'], 'count': d['count'], 'amount': round(d['amount'], 2)} for d in _breakdown(since, 'type')],
+        'by_status': [{'status': d['_id'], 'count': d['count'], 'amount': round(d['amount'], 2)} for d in _breakdown(since, 'status')],
+        'top_accounts': [{
+            'account_no': a['_id'],
+            'volume': round(a.get('volume', 0), 2),
+            'sent_amount': round(a.get('sent_amount', 0), 2),
+            'received_amount': round(a.get('received_amount', 0), 2),
+            'count': a.get('sent_count', 0) + a.get('received_count', 0)
+        } for a in top_accounts]
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Refresh the analytics views.')
+    parser.add_argument('command', choices=['refresh'])
+    parser.add_argument('--watch', action='store_true', help='Keep refreshing every --interval seconds')
+    parser.add_argument('--interval', type=float, default=REFRESH_INTERVAL)
+    args = parser.parse_args(argv)
+
+    from app import app
+    with app.app_context():
+        while True:
+            refresh()
+            if not args.watch:
+                break
+            time.sleep(args.interval)
+    print("Analytics views refreshed")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
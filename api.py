@@ -0,0 +1,186 @@
+# JSON API for Code Yatra Bank mobile clients
+#
+# Versioned under /api/v1. Uses the same session login as the web app
+# (POST /api/v1/login). Queries project only the fields each response needs,
+# and responses are serialized with orjson when it is installed, which handles
+# datetime natively; ObjectId is encoded as its hex string.
+
+import json
+import math
+from datetime import datetime
+
+from bson import ObjectId
+from flask import Blueprint, Response, request, session, url_for
+
+import account_filter
+from models import User, Transaction, Request
+from utils import transfer_money, submit_request, mask_aadhar
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+MAX_PAGE_SIZE = 200
+DEFAULT_PAGE_SIZE = 50
+TRANSACTION_FIELDS = {'_id': 1, 'type': 1, 'sender_account': 1, 'receiver_account': 1, 'amount': 1,
+                      'method': 1, 'status': 1, 'balance_after_transaction': 1, 'transaction_time.timestamp': 1}
+
+
+def _default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Cannot serialize {type(obj).__name__}")
+
+
+def dumps(data):
+    """Serialize to JSON bytes, with orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(data, default=_default)
+    return json.dumps(data, default=_default, separators=(',', ':')).encode('utf-8')
+
+
+def _json(data, status=200):
+    return Response(dumps(data), status=status, mimetype='application/json')
+
+
+def _error(message, status):
+    return _json({'error': message}, status)
+
+
+def _current_account():
+    if session.get('user_role') != 'user':
+        return None
+    return session.get('account_no')
+
+
+def _transaction_row(txn, account_no):
+    """Compact history row as seen from account_no"""
+    txn_type = txn.get('type', '')
+    sender = txn.get('sender_account', '')
+    if txn_type == 'transfer':
+        txn_type = 'debit' if sender == account_no else 'credit'
+    counterparty = txn.get('receiver_account', '') if sender == account_no else sender
+    return {
+        'id': txn['_id'],
+        'type': txn_type,
+        'amount': txn.get('amount', 0.0),
+        'counterparty': counterparty,
+        'method': txn.get('method', 'Transfer'),
+        'status': txn.get('status', 'success'),
+        'balance_after': txn.get('balance_after_transaction', 0.0) if sender == account_no else None,
+        'time': txn.get('transaction_time', {}).get('timestamp')
+    }
+
+
+@api.route('/login', methods=['POST'])
+def login():
+    body = request.get_json(silent=True) or {}
+    user = User.find_by_account_no(str(body.get('account_no', '')))
+    if not user or not user.check_mpin(str(body.get('mpin', ''))):
+        return _error('Invalid user credentials', 401)
+    session['account_no'] = user.account_no
+    session['user_role'] = 'user'
+    return _json({'account_no': user.account_no, 'name': user.name})
+
+
+@api.route('/balance')
+def balance():
+    account_no = _current_account()
+    if not account_no:
+        return _error('Login required', 401)
+    return _json({'account_no': account_no, 'balance': User.get_balance(account_no), 'currency': 'INR'})
+
+
+@api.route('/transactions')
+def transactions():
+    """Newest first. Pass the last row's id as ?before= to get the next page."""
+    account_no = _current_account()
+    if not account_no:
+        return _error('Login required', 401)
+    limit = min(max(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    before = request.args.get('before')
+    if before and not ObjectId.is_valid(before):
+        return _error('Invalid cursor', 400)
+    rows = Transaction.find_page_for_user(account_no, limit + 1, ObjectId(before) if before else None, TRANSACTION_FIELDS)
+    items = [_transaction_row(txn, account_no) for txn in rows[:limit]]
+    return _json({
+        'items': items,
+        'next': str(items[-1]['id']) if len(rows) > limit else None
+    })
+
+
+@api.route('/transfer', methods=['POST'])
+def transfer():
+    account_no = _current_account()
+    if not account_no:
+        return _error('Login required', 401)
+    body = request.get_json(silent=True) or {}
+    recipient_acc = str(body.get('recipient', ''))
+    try:
+        amount = float(body.get('amount'))
+    except (TypeError, ValueError):
+        return _error('Invalid amount', 400)
+    # NaN and inf pass a plain `<= 0` check and would poison both balances
+    if not math.isfinite(amount) or round(amount, 2) <= 0:
+        return _error('Invalid amount', 400)
+    amount = round(amount, 2)
+    if recipient_acc == account_no:
+        return _error('Cannot transfer to yourself', 400)
+    if not account_filter.accounts.might_exist(recipient_acc) or not User.exists(recipient_acc):
+        return _error('Invalid account number', 400)
+    current_user = User.find_by_account_no(account_no)
+    if not current_user.check_mpin(str(body.get('mpin', ''))):
+        return _error('Invalid MPIN', 403)
+    result = transfer_money(account_no, recipient_acc, amount, idempotency_key=request.headers.get('Idempotency-Key'))
+    if result is None:
+        return _error('Transfer is already being processed or its outcome is not known yet', 409)
+    if not result:
+        return _error('Transfer failed', 422)
+    return _json({'status': 'success', 'balance': User.get_balance(account_no)})
+
+
+@api.route('/requests', methods=['GET', 'POST'])
+def requests():
+    account_no = _current_account()
+    if not account_no:
+        return _error('Login required', 401)
+    if request.method == 'POST':
+        body = request.get_json(silent=True) or {}
+        req_type = body.get('type')
+        if req_type not in ('passbook', 'chequebook'):
+            return _error('type must be passbook or chequebook', 400)
+        req = submit_request(account_no, req_type)
+        return _json({'id': req.req_id, 'type': req.req_type, 'status': req.status, 'created_at': req.created_at}, 201)
+    return _json({'items': [{
+        'id': req['req_id'],
+        'type': req['type'],
+        'status': req['status'],
+        'created_at': req['created_at']
+    } for req in Request.find_by_account(account_no)]})
+
+
+@api.route('/passbook')
+def passbook():
+    account_no = _current_account()
+    if not account_no:
+        return _error('Login required', 401)
+    user = User.find_by_account_no(account_no)
+    stats = Transaction.stats_for_user(account_no)
+    return _json({
+        'account_no': user.account_no,
+        'name': user.name,
+        'cif_no': user.cif_no,
+        'ifsc_code': user.ifsc_code,
+        'micr_code': user.micr_code,
+        'opened_on': user.created_at,
+        'aadhar': mask_aadhar(user.aadhar) if user.aadhar else '',
+        'transaction_count': stats['count'],
+        'first_transaction_at': stats['first'],
+        'last_transaction_at': stats['last'],
+        'pdf_url': url_for('user_passbook_pdf')
+    })
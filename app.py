@@ -1,21 +1,54 @@
-from flask import Flask, render_template, redirect, url_for, flash, request, abort, send_file, session
+from flask import Flask, render_template, redirect, url_for, flash, request, abort, send_file, session, jsonify
 from flask_pymongo import PyMongo
 import bcrypt
 from datetime import datetime
-from forms import LoginForm, AddUserForm, CreditDebitForm, ApproveRequestForm, TransferForm, RequestForm
+from uuid import uuid4
+from forms import LoginForm, AddUserForm, CreditDebitForm, ApproveRequestForm, TransferForm, RequestForm, StandingInstructionForm, ImportCustomersForm
 from bson import ObjectId
-from utils import transfer_money, credit_user, debit_user, submit_request, approve_request, reject_request, mask_aadhar
-from models import User, Transaction, Request, Admin
+from utils import transfer_money, credit_user, debit_user, submit_request, approve_request, reject_request, approve_requests, reject_requests, decide_all_pending, mask_aadhar
+from models import User, Transaction, Request, Admin, IdempotencyKey, StandingInstruction, Notification
 from db import mongo
 from pdf import generate_passbook_pdf
+import assets
+import template_cache
+import velocity
+import analytics
+import importer
+import ledger_writer
+import ledger_router
+import account_filter
+import notifications
+from template_cache import LazyRows
+from api import api
 
 app = Flask(__name__)
 app.secret_key = "your_secret_key"
 
 # MongoDB setup
 app.config["MONGO_URI"] = "mongodb://localhost:27017/codeyatra_bank"
+# Any setting can be overridden from the environment with a FLASK_ prefix,
+# e.g. FLASK_MONGO_URI, FLASK_LEDGER_PARTITIONS=4, FLASK_LEDGER_GROUP_COMMIT=true
+app.config.from_prefixed_env()
 mongo.init_app(app)
 
+# Fingerprinted static assets (built with: python assets.py build)
+assets.init_app(app)
+
+# Bytecode cache, {% cache %} fragment tag and gzip for large pages
+template_cache.init_app(app)
+
+# Optional group commit for ledger inserts (set LEDGER_GROUP_COMMIT = true to enable)
+ledger_writer.init_app(app)
+
+# Ledger storage: one collection, or LEDGER_PARTITIONS hash partitions
+ledger_router.init_app(app)
+
+# Mail settings for the notification dispatcher (python notifications.py)
+notifications.init_app(app)
+
+# JSON API for the mobile app
+app.register_blueprint(api)
+
 @app.route('/')
 def home():
     return render_template("home.html")  # Home page
@@ -62,7 +95,6 @@ def register():
         if initial_deposit <= 0:
             flash('Initial deposit must be greater than 0')
             return redirect(url_for('login'))
-        account_no = User.generate_account_number()
         name = form.name.data
         email = form.email.data
         phone = form.phone.data
@@ -71,8 +103,8 @@ def register():
         pan = form.pan.data
         aadhar = form.aadhar.data
         mpin = form.mpin.data
-        user = User(account_no, name, email, mpin, balance=initial_deposit, phone=phone, address=address, dob=dob, pan=pan, aadhar=aadhar)
-        user.save()
+        user = User('', name, email, mpin, balance=initial_deposit, phone=phone, address=address, dob=dob, pan=pan, aadhar=aadhar)
+        account_no = user.save_new_account()
         flash(f'Registration successful! Your account number is {account_no}. Please login.')
         return redirect(url_for('login'))
     else:
@@ -103,7 +135,7 @@ def admin_dashboard():
         return redirect(url_for('login'))
     # Fetch users and transactions from MongoDB
     users = list(mongo.db.users.find())
-    transactions = list(mongo.db.transactions.find())
+    transactions = Transaction.find_all()
     return render_template("admin/dashboard.html", users=users, transactions=transactions)
 
 @app.route('/user/dashboard')
@@ -136,7 +168,6 @@ def admin_add_user():
         if initial_deposit <= 0:
             flash('Initial deposit must be greater than 0')
             return redirect(url_for('admin_add_user'))
-        account_no = User.generate_account_number()
         name = form.name.data
         email = form.email.data
         phone = form.phone.data
@@ -145,18 +176,31 @@ def admin_add_user():
         pan = form.pan.data
         aadhar = form.aadhar.data
         mpin = form.mpin.data
-        user = User(account_no, name, email, mpin, balance=initial_deposit, phone=phone, address=address, dob=dob, pan=pan, aadhar=aadhar)
-        user.save()
+        user = User('', name, email, mpin, balance=initial_deposit, phone=phone, address=address, dob=dob, pan=pan, aadhar=aadhar)
+        user.save_new_account()
         flash('User added successfully')
         return redirect(url_for('admin_users'))
     return render_template('admin/add_user.html', form=form)
 
+@app.route('/admin/import_users', methods=['GET', 'POST'])
+def admin_import_users():
+    if session.get('user_role') != 'admin':
+        flash('Please log in as admin to access this page')
+        return redirect(url_for('login'))
+    form = ImportCustomersForm()
+    report = None
+    if form.validate_on_submit():
+        report = importer.import_file(form.file.data, workers=importer.DEFAULT_WORKERS)
+        flash(f"Imported {report['inserted']} of {report['read']} customers")
+    return render_template('admin/import_users.html', form=form, report=report)
+
 @app.route('/admin/delete_user/<account_no>', methods=['POST'])
 def admin_delete_user(account_no):
     if session.get('user_role') != 'admin':
         flash('Please log in as admin to access this page')
         return redirect(url_for('login'))
     mongo.db.users.delete_one({'account_no': account_no})
+    account_filter.accounts.remove(account_no)
     flash('User deleted successfully')
     return redirect(url_for('admin_users'))
 
@@ -185,48 +229,78 @@ def admin_transactions():
     if session.get('user_role') != 'admin':
         flash('Please log in as admin to access this page')
         return redirect(url_for('login'))
-    transactions = Transaction.find_all()
-    # Filter duplicates by unique transaction_id
-    unique_txn_ids = set()
-    filtered_transactions = []
-    for txn in transactions:
-        txn_id = txn.get('transaction_id') or txn.get('txn_id')
-        if txn_id and txn_id not in unique_txn_ids:
-            unique_txn_ids.add(txn_id)
-            # Determine display_type
-            txn_type = txn.get('type', '')
-            if txn_type == 'transfer':
-                # Determine credit or debit based on sender and receiver
-                sender = txn.get('sender_account', '')
-                receiver = txn.get('receiver_account', '')
-                # For admin view, assume admin account is 'admin'
-                if sender == 'admin':
-                    display_type = 'debit'
+    def load_transactions():
+        transactions = Transaction.find_all()
+        # Filter duplicates by unique transaction_id
+        unique_txn_ids = set()
+        filtered_transactions = []
+        for txn in transactions:
+            txn_id = txn.get('transaction_id') or txn.get('txn_id')
+            if txn_id and txn_id not in unique_txn_ids:
+                unique_txn_ids.add(txn_id)
+                # Determine display_type
+                txn_type = txn.get('type', '')
+                if txn_type == 'transfer':
+                    # Determine credit or debit based on sender and receiver
+                    sender = txn.get('sender_account', '')
+                    receiver = txn.get('receiver_account', '')
+                    # For admin view, assume admin account is 'admin'
+                    if sender == 'admin':
+                        display_type = 'debit'
+                    else:
+                        display_type = 'credit'
                 else:
-                    display_type = 'credit'
-            else:
-                display_type = txn_type
-            txn['display_type'] = display_type
-            filtered_transactions.append(txn)
-    return render_template('admin/transactions.html', transactions=filtered_transactions)
+                    display_type = txn_type
+                txn['display_type'] = display_type
+                filtered_transactions.append(txn)
+        return filtered_transactions
+    return render_template('admin/transactions.html', transactions=LazyRows(load_transactions), latest_txn_id=Transaction.latest_id())
 
 @app.route('/admin/requests', methods=['GET', 'POST'])
 def admin_requests():
     if session.get('user_role') != 'admin':
         flash('Please log in as admin to access this page')
         return redirect(url_for('login'))
+    status = request.args.get('status', 'pending')
+    if status not in Request.STATUSES:
+        status = 'pending'
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 500)
     if request.method == 'POST':
-        req_id = request.form.get('request_id')
         action = request.form.get('action')
-        if action == 'approve':
-            approve_request(req_id)
-            flash('Request approved')
+        new_status = 'approved' if action == 'approve' else 'rejected'
+        if request.form.get('scope') == 'all_pending':
+            changed = decide_all_pending(new_status)
+            flash(f'{changed} pending request(s) {new_status}')
         else:
-            reject_request(req_id)
-            flash('Request rejected')
-        return redirect(url_for('admin_requests'))
-    requests_list = Request.find_all()
-    return render_template('admin/requests.html', requests=requests_list)
+            req_ids = request.form.getlist('request_ids') or [request.form.get('request_id')]
+            req_ids = [req_id for req_id in req_ids if req_id]
+            if len(req_ids) == 1:
+                changed = approve_request(req_ids[0]) if action == 'approve' else reject_request(req_ids[0])
+                flash(f'Request {new_status}' if changed else 'Request is no longer pending')
+            else:
+                changed = approve_requests(req_ids) if action == 'approve' else reject_requests(req_ids)
+                flash(f'{changed} request(s) {new_status}')
+        return redirect(url_for('admin_requests', status=status, page=page, per_page=per_page))
+    total = Request.count_by_status(status)
+    pages = max((total + per_page - 1) // per_page, 1)
+    requests_list = Request.find_by_status(status, page, per_page)
+    return render_template('admin/requests.html', requests=requests_list, status=status, page=page, pages=pages, per_page=per_page, total=total)
+
+@app.route('/admin/analytics')
+def admin_analytics():
+    if session.get('user_role') != 'admin':
+        flash('Please log in as admin to access this page')
+        return redirect(url_for('login'))
+    # Views are refreshed by python analytics.py refresh --watch, not per request
+    return render_template('admin/analytics.html', summary=analytics.summary())
+
+@app.route('/admin/analytics/data')
+def admin_analytics_data():
+    if session.get('user_role') != 'admin':
+        abort(403)
+    days = request.args.get('days', 365, type=int)
+    return jsonify(analytics.summary(days))
 
 @app.route('/user/balance')
 def user_balance():
@@ -251,22 +325,78 @@ def user_transfer():
         if recipient_acc == current_acc:
             flash('Cannot transfer to yourself')
             return redirect(url_for('user_transfer'))
-        recipient = User.find_by_account_no(recipient_acc)
-        if not recipient:
+        # The account filter turns away mistyped numbers without a DB lookup
+        if not account_filter.accounts.might_exist(recipient_acc) or not User.exists(recipient_acc):
             flash('Invalid account number')
             return redirect(url_for('user_transfer'))
         current_user = User.find_by_account_no(current_acc)
         if not current_user.check_mpin(mpin):
             flash('Invalid MPIN')
             return redirect(url_for('user_transfer'))
-        if transfer_money(current_acc, recipient_acc, amount):
+        # Clients may send the key as a header; the HTML form carries it as a hidden field
+        idempotency_key = request.headers.get('Idempotency-Key') or form.idempotency_key.data or None
+        result = transfer_money(current_acc, recipient_acc, amount, idempotency_key=idempotency_key)
+        if result is None:
+            flash('This transfer is already being processed')
+            return redirect(url_for('user_dashboard'))
+        if result:
             flash('Transfer successful')
             return redirect(url_for('user_dashboard'))
         else:
             flash('Transfer failed')
             return redirect(url_for('user_transfer'))
+    # Fresh key per rendered form so a resubmitted form is not executed twice
+    form.idempotency_key.data = str(uuid4())
     return render_template('user/transfer.html', form=form)
 
+@app.route('/user/standing_instructions', methods=['GET', 'POST'])
+def user_standing_instructions():
+    if session.get('user_role') != 'user':
+        flash('Please log in as user to access this page')
+        return redirect(url_for('login'))
+    form = StandingInstructionForm()
+    current_acc = session.get('account_no')
+    if form.validate_on_submit():
+        recipient_acc = form.recipient.data
+        if recipient_acc == current_acc:
+            flash('Cannot transfer to yourself')
+            return redirect(url_for('user_standing_instructions'))
+        if not account_filter.accounts.might_exist(recipient_acc) or not User.exists(recipient_acc):
+            flash('Invalid account number')
+            return redirect(url_for('user_standing_instructions'))
+        if form.amount.data <= 0:
+            flash('Amount must be greater than 0')
+            return redirect(url_for('user_standing_instructions'))
+        current_user = User.find_by_account_no(current_acc)
+        if not current_user.check_mpin(form.mpin.data):
+            flash('Invalid MPIN')
+            return redirect(url_for('user_standing_instructions'))
+        # A past start would make every missed period due at once
+        if form.first_run.data < datetime.utcnow().date():
+            flash('First payment date cannot be in the past')
+            return redirect(url_for('user_standing_instructions'))
+        if form.end_date.data and form.end_date.data < form.first_run.data:
+            flash('End date must be after the first payment date')
+            return redirect(url_for('user_standing_instructions'))
+        first_run = datetime.combine(form.first_run.data, datetime.min.time())
+        end_date = datetime.combine(form.end_date.data, datetime.max.time()) if form.end_date.data else None
+        StandingInstruction.create(current_acc, recipient_acc, form.amount.data, form.frequency.data, first_run, end_date)
+        flash('Standing instruction set up successfully')
+        return redirect(url_for('user_standing_instructions'))
+    instructions = StandingInstruction.find_by_account(current_acc)
+    return render_template('user/standing_instructions.html', form=form, instructions=instructions)
+
+@app.route('/user/standing_instructions/<si_id>/cancel', methods=['POST'])
+def user_cancel_standing_instruction(si_id):
+    if session.get('user_role') != 'user':
+        flash('Please log in as user to access this page')
+        return redirect(url_for('login'))
+    if StandingInstruction.cancel(si_id, session.get('account_no')):
+        flash('Standing instruction cancelled')
+    else:
+        flash('Standing instruction not found')
+    return redirect(url_for('user_standing_instructions'))
+
 @app.route('/user/request', methods=['GET', 'POST'])
 def user_request():
     if session.get('user_role') != 'user':
@@ -287,7 +417,7 @@ def user_requests():
         flash('Please log in as user to access this page')
         return redirect(url_for('login'))
     account_no = session.get('account_no')
-    requests_list = list(mongo.db.requests.find({'acc_no': account_no}))
+    requests_list = Request.find_by_account(account_no)
     return render_template('user/requests.html', requests=requests_list)
 
 @app.route('/user/transactions')
@@ -296,29 +426,31 @@ def user_transactions():
         flash('Please log in as user to access this page')
         return redirect(url_for('login'))
     account_no = session.get('account_no')
-    transactions = Transaction.find_by_user(account_no)
-    seen_txn_ids = set()
-    filtered_transactions = []
-    for txn in transactions:
-        txn_id = txn.get('transaction_id') or txn.get('txn_id')
-        if not txn_id or txn_id in seen_txn_ids:
-            continue
-        txn_type = txn.get('type', '')
-        if txn_type == 'transfer':
-            sender = txn.get('sender_account', '')
-            receiver = txn.get('receiver_account', '')
-            # Only include transaction if user is sender or receiver
-            if sender == account_no:
-                txn['type'] = 'debit'
-            elif receiver == account_no:
-                txn['type'] = 'credit'
-            else:
+    def load_transactions():
+        transactions = Transaction.find_by_user(account_no)
+        seen_txn_ids = set()
+        filtered_transactions = []
+        for txn in transactions:
+            txn_id = txn.get('transaction_id') or txn.get('txn_id')
+            if not txn_id or txn_id in seen_txn_ids:
                 continue
-        seen_txn_ids.add(txn_id)
-        filtered_transactions.append(txn)
-    for txn in filtered_transactions:
-        txn['_id'] = str(txn['_id'])
-    return render_template('user/transactions.html', transactions=filtered_transactions)
+            txn_type = txn.get('type', '')
+            if txn_type == 'transfer':
+                sender = txn.get('sender_account', '')
+                receiver = txn.get('receiver_account', '')
+                # Only include transaction if user is sender or receiver
+                if sender == account_no:
+                    txn['type'] = 'debit'
+                elif receiver == account_no:
+                    txn['type'] = 'credit'
+                else:
+                    continue
+            seen_txn_ids.add(txn_id)
+            filtered_transactions.append(txn)
+        for txn in filtered_transactions:
+            txn['_id'] = str(txn['_id'])
+        return filtered_transactions
+    return render_template('user/transactions.html', transactions=LazyRows(load_transactions), latest_txn_id=Transaction.latest_id_for_user(account_no))
 
 @app.route('/user/passbook')
 def user_passbook():
@@ -327,29 +459,31 @@ def user_passbook():
         return redirect(url_for('login'))
     account_no = session.get('account_no')
     user = User.find_by_account_no(account_no)
-    transactions = Transaction.find_by_user(account_no)
-    seen_txn_ids = set()
-    filtered_transactions = []
-    for txn in transactions:
-        txn_id = txn.get('transaction_id') or txn.get('txn_id')
-        if not txn_id or txn_id in seen_txn_ids:
-            continue
-        txn_type = txn.get('type', '')
-        if txn_type == 'transfer':
-            sender = txn.get('sender_account', '')
-            receiver = txn.get('receiver_account', '')
-            # Only include transaction if user is sender or receiver
-            if sender == account_no:
-                txn['type'] = 'debit'
-            elif receiver == account_no:
-                txn['type'] = 'credit'
-            else:
+    def load_transactions():
+        transactions = Transaction.find_by_user(account_no)
+        seen_txn_ids = set()
+        filtered_transactions = []
+        for txn in transactions:
+            txn_id = txn.get('transaction_id') or txn.get('txn_id')
+            if not txn_id or txn_id in seen_txn_ids:
                 continue
-        seen_txn_ids.add(txn_id)
-        filtered_transactions.append(txn)
-    filtered_transactions.sort(key=lambda x: x['transaction_time']['timestamp'])
+            txn_type = txn.get('type', '')
+            if txn_type == 'transfer':
+                sender = txn.get('sender_account', '')
+                receiver = txn.get('receiver_account', '')
+                # Only include transaction if user is sender or receiver
+                if sender == account_no:
+                    txn['type'] = 'debit'
+                elif receiver == account_no:
+                    txn['type'] = 'credit'
+                else:
+                    continue
+            seen_txn_ids.add(txn_id)
+            filtered_transactions.append(txn)
+        filtered_transactions.sort(key=lambda x: x['transaction_time']['timestamp'])
+        return filtered_transactions
     masked_aadhar = mask_aadhar(user.aadhar) if user.aadhar else ''
-    return render_template('user/passbook.html', user=user, transactions=filtered_transactions, masked_aadhar=masked_aadhar)
+    return render_template('user/passbook.html', user=user, transactions=LazyRows(load_transactions), latest_txn_id=Transaction.latest_id_for_user(account_no), masked_aadhar=masked_aadhar)
 
 
 @app.route('/user/passbook/pdf')
@@ -384,6 +518,13 @@ def user_passbook_pdf():
 
 # Create initial admin and users if none exist
 with app.app_context():
+    User.ensure_indexes()
+    Transaction.ensure_indexes()
+    IdempotencyKey.ensure_indexes()
+    analytics.ensure_indexes()
+    Request.ensure_indexes()
+    StandingInstruction.ensure_indexes()
+    Notification.ensure_indexes()
     if mongo.db.admins.count_documents({}) == 0:
         Admin.add_admin('admin', 'admin123')
         print("Default admin created: username='admin', password='admin123'")
@@ -392,6 +533,9 @@ with app.app_context():
         User.add_user('1234567890', 'John Doe', 'john@example.com', '1234', 1000.0)
         User.add_user('0987654321', 'Jane Smith', 'jane@example.com', '5678', 500.0)
         print("Sample users created")
+    # Velocity windows and the account filter live in memory, so reload them
+    velocity.engine.rebuild()
+    account_filter.accounts.rebuild()
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,193 @@
+# Static asset pipeline for Code Yatra Bank
+#
+# Build:  python assets.py build
+# Copies every file under static/ into static/dist/ with a content hash in its
+# name, writes .gz (and .br when brotli is installed) siblings for text assets,
+# and resized WebP variants of images (when Pillow is installed).
+# The mapping from logical name to built files is kept in static/dist/manifest.json.
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import sys
+
+from flask import url_for, request, send_from_directory, abort
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt')
+IMAGE_EXTENSIONS = ('.jpeg', '.jpg', '.png')
+WEBP_WIDTHS = (480, 960, 1600)
+WEBP_QUALITY = 80
+HASH_LENGTH = 10
+
+# Fingerprinted files never change, so browsers may keep them for a year
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+_manifest = None
+
+
+def _fingerprint(path):
+    """Return the first HASH_LENGTH hex chars of the file's SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def _hashed_name(logical_name, file_hash):
+    """image/logo.png -> image/logo.<hash>.png"""
+    base, ext = os.path.splitext(logical_name)
+    return f"{base}.{file_hash}{ext}"
+
+
+def _write_compressed(path):
+    """Write .gz and .br siblings next to a built text asset"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(data, quality=11))
+
+
+def _write_webp_variants(source, logical_name, file_hash):
+    """Write resized WebP copies of an image, never upscaling. Returns {width: dist name}."""
+    variants = {}
+    if Image is None:
+        return variants
+    with Image.open(source) as img:
+        img.load()
+        for width in WEBP_WIDTHS:
+            if width > img.width and variants:
+                break
+            target_width = min(width, img.width)
+            height = round(img.height * target_width / img.width)
+            resized = img.resize((target_width, height), Image.LANCZOS) if target_width != img.width else img
+            base = os.path.splitext(logical_name)[0]
+            name = f"{base}.{file_hash}.w{target_width}.webp"
+            out_path = os.path.join(DIST_DIR, name)
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            resized.save(out_path, 'WEBP', quality=WEBP_QUALITY, method=6)
+            variants[str(target_width)] = name
+    return variants
+
+
+def build():
+    """Build static/dist and its manifest. Returns the manifest."""
+    manifest = {}
+    for root, dirs, files in os.walk(STATIC_DIR):
+        # Never re-process our own output
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != DIST_DIR]
+        for filename in sorted(files):
+            source = os.path.join(root, filename)
+            logical_name = os.path.relpath(source, STATIC_DIR).replace(os.sep, '/')
+            file_hash = _fingerprint(source)
+            hashed = _hashed_name(logical_name, file_hash)
+            target = os.path.join(DIST_DIR, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(source, 'rb') as src, open(target, 'wb') as dst:
+                dst.write(src.read())
+
+            entry = {'path': hashed}
+            ext = os.path.splitext(filename)[1].lower()
+            if ext in COMPRESSIBLE_EXTENSIONS:
+                _write_compressed(target)
+            if ext in IMAGE_EXTENSIONS:
+                webp = _write_webp_variants(source, logical_name, file_hash)
+                if webp:
+                    entry['webp'] = webp
+            manifest[logical_name] = entry
+
+    with open(MANIFEST_PATH, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest():
+    """Load the build manifest, or an empty one when assets have not been built"""
+    global _manifest
+    if _manifest is None:
+        try:
+            with open(MANIFEST_PATH) as f:
+                _manifest = json.load(f)
+        except (OSError, ValueError):
+            _manifest = {}
+    return _manifest
+
+
+def asset_url(filename):
+    """
+    url_for('static', filename=...) replacement for templates.
+    Resolves to the fingerprinted file when assets have been built.
+    """
+    entry = load_manifest().get(filename)
+    if not entry:
+        return url_for('static', filename=filename)
+    return url_for('assets', filename=entry['path'])
+
+
+def asset_srcset(filename):
+    """WebP srcset string for an image, or '' when no variants were built"""
+    entry = load_manifest().get(filename)
+    if not entry or not entry.get('webp'):
+        return ''
+    return ', '.join(f"{url_for('assets', filename=name)} {width}w"
+                     for width, name in sorted(entry['webp'].items(), key=lambda item: int(item[0])))
+
+
+def serve_asset(filename):
+    """Send a fingerprinted file, preferring a precompressed sibling the client accepts"""
+    path = os.path.join(DIST_DIR, filename)
+    if not os.path.isfile(path):
+        abort(404)
+    accepted = request.headers.get('Accept-Encoding', '')
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if encoding in accepted and os.path.isfile(path + suffix):
+            response = send_from_directory(DIST_DIR, filename + suffix, mimetype=_guess_mimetype(filename))
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(DIST_DIR, filename)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+def _guess_mimetype(filename):
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def init_app(app):
+    """Register the /assets route and the template helpers"""
+    app.add_url_rule('/assets/<path:filename>', 'assets', serve_asset)
+    app.jinja_env.globals['asset_url'] = asset_url
+    app.jinja_env.globals['asset_srcset'] = asset_srcset
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'build':
+        print("Usage: python assets.py build")
+        sys.exit(1)
+    result = build()
+    print(f"Built {len(result)} assets into {DIST_DIR}")
+    if brotli is None:
+        print("brotli not installed: skipped .br files")
+    if Image is None:
+        print("Pillow not installed: skipped WebP variants")
@@ -0,0 +1,56 @@
+# Benchmark for the account-number Bloom filter
+#
+# Usage: python benchmarks/bench_account_filter.py [accounts] [probes]
+# Builds a filter sized the way AccountFilter.rebuild sizes it for `accounts`
+# random 10-digit account numbers, then probes it with `probes` numbers that
+# are not accounts. Reports memory, build and lookup cost, and the measured
+# false-positive rate against the configured target.
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from account_filter import BloomFilter, FALSE_POSITIVE_RATE, GROWTH, MIN_CAPACITY
+
+
+def run(accounts=1000000, probes=200000):
+    rng = random.Random(42)
+    members = set()
+    while len(members) < accounts:
+        members.add(str(rng.randint(1000000000, 9999999999)))
+    outsiders = []
+    while len(outsiders) < probes:
+        candidate = str(rng.randint(1000000000, 9999999999))
+        if candidate not in members:
+            outsiders.append(candidate)
+
+    bloom = BloomFilter(max(accounts * GROWTH, MIN_CAPACITY))
+    begin = time.perf_counter()
+    bloom.update(members)
+    build = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    false_positives = sum(1 for account_no in outsiders if account_no in bloom)
+    lookup = (time.perf_counter() - begin) / probes
+
+    stats = bloom.stats()
+    measured = false_positives / probes
+    print(f"accounts:          {accounts:,}")
+    print(f"capacity:          {stats['capacity']:,}")
+    print(f"memory:            {stats['memory_bytes'] / 1024 / 1024:.2f} MiB ({stats['bits_per_item']} bits/account)")
+    print(f"hash functions:    {stats['hashes']}")
+    print(f"build:             {build:.2f} s")
+    print(f"lookup:            {lookup * 1e6:.2f} us")
+    print(f"expected fp rate:  {stats['expected_fp_rate']:.5%}")
+    print(f"measured fp rate:  {measured:.5%} ({false_positives} of {probes:,})")
+    # At full capacity the rate would be FALSE_POSITIVE_RATE; allow sampling noise on top
+    return measured <= FALSE_POSITIVE_RATE * 1.5
+
+
+if __name__ == '__main__':
+    ok = run(*(int(arg) for arg in sys.argv[1:3]))
+    print("PASS" if ok else f"FAIL: false-positive rate above {FALSE_POSITIVE_RATE:.3%}")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,109 @@
+# Benchmark for the JSON API against the HTML pages it replaces
+#
+# Usage: python benchmarks/bench_api.py [--uri URI] [--transactions N] [--calls N]
+# Needs a running MongoDB. Points the app at a scratch database, seeds an
+# account with `transactions` ledger entries, calls each HTML route and its
+# /api/v1 counterpart `calls` times through the Flask test client, and reports
+# response bytes and server time per call. The scratch database is dropped afterwards.
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import uri_parser
+
+DEFAULT_URI = "mongodb://localhost:27017/codeyatra_bank_bench"
+LIVE_DATABASE = 'codeyatra_bank'
+BENCH_ACCOUNT = '9999999990'
+PEER_ACCOUNT = '9999999991'
+PAGES = [
+    ('balance', '/user/balance', '/api/v1/balance'),
+    ('history', '/user/transactions', '/api/v1/transactions?limit=50'),
+    ('requests', '/user/requests', '/api/v1/requests'),
+    ('passbook', '/user/passbook', '/api/v1/passbook'),
+]
+
+
+def seed(transactions):
+    from db import mongo
+    import ledger_router
+    from models import User, Transaction
+
+    for account_no in (BENCH_ACCOUNT, PEER_ACCOUNT):
+        User(account_no, 'Bench User', 'bench@example.com', '1234', balance=100000.0).save()
+    rng = random.Random(42)
+    start = datetime.utcnow() - timedelta(days=365)
+    documents = []
+    for i in range(transactions):
+        outgoing = rng.random() < 0.5
+        timestamp = start + timedelta(minutes=i)
+        documents.append(Transaction(
+            f"BENCH{i}", 'transfer',
+            BENCH_ACCOUNT if outgoing else PEER_ACCOUNT,
+            PEER_ACCOUNT if outgoing else BENCH_ACCOUNT,
+            round(rng.uniform(10, 5000), 2),
+            balance_after_transaction=round(rng.uniform(0, 100000), 2),
+            transaction_time={'date': timestamp.strftime('%Y-%m-%d'), 'time': timestamp.strftime('%H:%M:%S'), 'timestamp': timestamp}
+        ).to_document())
+    for collection, docs in ledger_router.router.group_placements(documents):
+        collection.insert_many(docs)
+    for i in range(20):
+        mongo.db.requests.insert_one({'req_id': f"BENCH{i}", 'acc_no': BENCH_ACCOUNT, 'type': 'passbook', 'status': 'pending', 'created_at': datetime.utcnow()})
+
+
+def measure(client, path, calls):
+    """Return (response bytes, mean ms per call, mean CPU ms per call)"""
+    size = len(client.get(path).data)  # Warm-up, also fills any page caches
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    for _ in range(calls):
+        response = client.get(path)
+        assert response.status_code == 200, (path, response.status_code)
+    wall = (time.perf_counter() - wall) / calls * 1000
+    cpu = (time.process_time() - cpu) / calls * 1000
+    return size, wall, cpu
+
+
+def run(uri=DEFAULT_URI, transactions=2000, calls=50):
+    database = uri_parser.parse_uri(uri)['database']
+    if not database or database == LIVE_DATABASE:
+        raise SystemExit(f"Refusing to run against {database or 'no database'}: the database is dropped afterwards")
+    # Read by app.config.from_prefixed_env() when the app is imported
+    os.environ['FLASK_MONGO_URI'] = uri
+    from app import app
+    from db import mongo
+    if mongo.db.name != database:
+        raise SystemExit(f"The app was already set up against {mongo.db.name}; run the benchmark as a script")
+    try:
+        with app.app_context():
+            seed(transactions)
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['account_no'] = BENCH_ACCOUNT
+            sess['user_role'] = 'user'
+        print(f"{'page':<10} {'html bytes':>11} {'api bytes':>10} {'html ms':>8} {'api ms':>7} {'html cpu':>9} {'api cpu':>8}")
+        for name, html_path, api_path in PAGES:
+            html_size, html_ms, html_cpu = measure(client, html_path, calls)
+            api_size, api_ms, api_cpu = measure(client, api_path, calls)
+            print(f"{name:<10} {html_size:>11,} {api_size:>10,} {html_ms:>8.2f} {api_ms:>7.2f} {html_cpu:>9.2f} {api_cpu:>8.2f}")
+    finally:
+        mongo.cx.drop_database(database)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the JSON API with the HTML pages it replaces.')
+    parser.add_argument('--uri', default=DEFAULT_URI, help='Scratch database; dropped afterwards')
+    parser.add_argument('--transactions', type=int, default=2000)
+    parser.add_argument('--calls', type=int, default=50)
+    args = parser.parse_args(argv)
+    run(args.uri, args.transactions, args.calls)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
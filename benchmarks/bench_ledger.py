@@ -0,0 +1,100 @@
+# Benchmark for group-commit ledger writes
+#
+# Usage: python benchmarks/bench_ledger.py [--uri URI] [--writes N] [--threads 1,8,32,64] [--delays 0.5,1,2,5,10]
+# Needs a running MongoDB. Writes ledger-shaped documents from concurrent
+# threads into a scratch collection, first with one journaled insert_one per
+# write, then through GroupCommitWriter at each flush delay, and prints
+# throughput and per-write latency for every combination. The scratch
+# collection is dropped afterwards.
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import MongoClient
+
+from ledger_writer import GroupCommitWriter, JOURNALED
+from models import Transaction
+
+DEFAULT_URI = "mongodb://localhost:27017/codeyatra_bank"
+SCRATCH = 'bench_ledger'
+
+
+def _document(i):
+    return Transaction(f"BENCH{i}", 'transfer', '1000000000', '1000000001', 100.0, balance_after_transaction=1000.0).to_document()
+
+
+def _drive(write, writes, threads):
+    """Run `writes` calls of write(doc) spread over `threads` threads. Returns (seconds, sorted latencies)."""
+    latencies = []
+    lock = threading.Lock()
+    per_thread = writes // threads
+
+    def worker(offset):
+        local = []
+        for i in range(per_thread):
+            document = _document(offset + i)
+            t0 = time.perf_counter()
+            write(document)
+            local.append(time.perf_counter() - t0)
+        with lock:
+            latencies.extend(local)
+
+    pool = [threading.Thread(target=worker, args=(n * per_thread,)) for n in range(threads)]
+    begin = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - begin
+    latencies.sort()
+    return elapsed, latencies
+
+
+def _report(label, threads, elapsed, latencies, batches=None):
+    count = len(latencies)
+    p50 = latencies[count // 2] * 1000
+    p99 = latencies[min(int(count * 0.99), count - 1)] * 1000
+    avg_batch = f"{count / batches:9.1f}" if batches else f"{'-':>9}"
+    print(f"{label:<14} {threads:>7} {count / elapsed:>10,.0f} {p50:>8.2f} {p99:>8.2f} {avg_batch}")
+
+
+def run(uri=DEFAULT_URI, writes=20000, threads=(1, 8, 32, 64), delays=(0.5, 1.0, 2.0, 5.0, 10.0)):
+    client = MongoClient(uri)
+    try:
+        collection = client.get_default_database()[SCRATCH]
+        collection.drop()
+        direct = collection.with_options(write_concern=JOURNALED)
+        print(f"{'mode':<14} {'threads':>7} {'writes/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'avg batch':>9}")
+        for n in threads:
+            elapsed, latencies = _drive(direct.insert_one, writes, n)
+            _report('insert_one', n, elapsed, latencies)
+            for delay in delays:
+                writer = GroupCommitWriter(collection, delay_ms=delay)
+                elapsed, latencies = _drive(writer.write, writes, n)
+                writer.close()
+                _report(f"group {delay:g}ms", n, elapsed, latencies, writer.batches)
+    finally:
+        client.get_default_database().drop_collection(SCRATCH)
+        client.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare per-insert and group-commit ledger writes.')
+    parser.add_argument('--uri', default=DEFAULT_URI)
+    parser.add_argument('--writes', type=int, default=20000)
+    parser.add_argument('--threads', default='1,8,32,64')
+    parser.add_argument('--delays', default='0.5,1,2,5,10', help='Group-commit flush delays in ms')
+    args = parser.parse_args(argv)
+    run(args.uri, args.writes,
+        [int(n) for n in args.threads.split(',')],
+        [float(d) for d in args.delays.split(',')])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
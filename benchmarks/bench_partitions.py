@@ -0,0 +1,101 @@
+# Benchmark for the partitioned ledger
+#
+# Usage: python benchmarks/bench_partitions.py [--uri URI] [--entries N] [--accounts N] [--partitions 1,4,16]
+# Needs a running MongoDB. For each partition count, loads `entries` random
+# transfers through LedgerRouter into a scratch database, then times per-account
+# history reads (one partition) and a bank-wide time-ordered read (fan-out and
+# merge). The scratch database is dropped afterwards.
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import MongoClient, ASCENDING, DESCENDING, uri_parser
+
+from ledger_router import LedgerRouter
+from models import Transaction
+
+DEFAULT_URI = "mongodb://localhost:27017/codeyatra_bank_bench"
+LIVE_DATABASE = 'codeyatra_bank'
+HISTORY_READS = 500
+
+
+def _entries(count, accounts, rng):
+    start = datetime.utcnow() - timedelta(days=30)
+    for i in range(count):
+        sender, receiver = rng.sample(accounts, 2)
+        timestamp = start + timedelta(seconds=i)
+        yield Transaction(
+            f"BENCH{i}", 'transfer', sender, receiver, round(rng.uniform(10, 5000), 2),
+            transaction_time={'date': timestamp.strftime('%Y-%m-%d'), 'time': timestamp.strftime('%H:%M:%S'), 'timestamp': timestamp}
+        ).to_document()
+
+
+def run_layout(db, partitions, entries, accounts):
+    router = LedgerRouter(db, partitions)
+    for collection in router.collections:
+        collection.drop()
+        collection.create_index([('sender_account', ASCENDING), ('_id', DESCENDING)])
+        collection.create_index([('receiver_account', ASCENDING), ('_id', DESCENDING)])
+        collection.create_index([('transaction_time.timestamp', ASCENDING)])
+    rng = random.Random(42)
+
+    begin = time.perf_counter()
+    batch = []
+    for document in _entries(entries, accounts, rng):
+        batch.append(document)
+        if len(batch) >= 10000:
+            for collection, docs in router.group_placements(batch):
+                collection.insert_many(docs, ordered=False)
+            batch = []
+    for collection, docs in router.group_placements(batch):
+        collection.insert_many(docs, ordered=False)
+    load = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    for account_no in rng.sample(accounts, min(HISTORY_READS, len(accounts))):
+        query = {'$or': [{'sender_account': account_no}, {'receiver_account': account_no}]}
+        list(router.for_account(account_no).find(query).sort('_id', DESCENDING).limit(50))
+    history = (time.perf_counter() - begin) / min(HISTORY_READS, len(accounts))
+
+    begin = time.perf_counter()
+    rows = sum(1 for _ in router.find_merged({}, projection={'_id': 0, 'amount': 1, 'transaction_time.timestamp': 1}))
+    bank_wide = time.perf_counter() - begin
+
+    stored = sum(c.estimated_document_count() for c in router.collections)
+    print(f"{max(partitions, 1):>10} {entries / load:>12,.0f} {stored:>10,} {history * 1000:>11.2f} {bank_wide:>13.2f} {rows:>10,}")
+    for collection in router.collections:
+        collection.drop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare ledger layouts with 1..N hash partitions.')
+    parser.add_argument('--uri', default=DEFAULT_URI, help='Scratch database; dropped afterwards')
+    parser.add_argument('--entries', type=int, default=200000)
+    parser.add_argument('--accounts', type=int, default=20000)
+    parser.add_argument('--partitions', default='1,4,16')
+    args = parser.parse_args(argv)
+
+    database = uri_parser.parse_uri(args.uri)['database']
+    if not database or database == LIVE_DATABASE:
+        raise SystemExit(f"Refusing to run against {database or 'no database'}: the database is dropped afterwards")
+    client = MongoClient(args.uri)
+    db = client.get_default_database()
+    accounts = [str(3000000000 + i) for i in range(args.accounts)]
+    try:
+        print(f"{'partitions':>10} {'inserts/s':>12} {'stored':>10} {'history ms':>11} {'bank-wide s':>13} {'rows':>10}")
+        for partitions in (int(p) for p in args.partitions.split(',')):
+            run_layout(db, partitions, args.entries, accounts)
+    finally:
+        client.drop_database(db.name)
+        client.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
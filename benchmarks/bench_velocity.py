@@ -0,0 +1,57 @@
+# Benchmark for the transfer velocity checks
+#
+# Usage: python benchmarks/bench_velocity.py [transfers]
+# Replays synthetic transfers at 10k/sec of simulated time across 200k accounts
+# and reports the cost of VelocityEngine.authorize() per transfer.
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from velocity import VelocityEngine
+
+RATE_PER_SEC = 10000
+ACCOUNTS = 200000
+BUDGET_US = 50.0
+
+
+def run(transfers=200000):
+    engine = VelocityEngine()
+    rng = random.Random(42)
+    accounts = [str(1000000000 + i) for i in range(ACCOUNTS)]
+    senders = [rng.choice(accounts) for _ in range(transfers)]
+    recipients = [rng.choice(accounts) for _ in range(transfers)]
+    amounts = [round(rng.uniform(10, 5000), 2) for _ in range(transfers)]
+    start_ts = time.time()
+
+    samples = []
+    rejected = 0
+    begin = time.perf_counter()
+    for i in range(transfers):
+        now = start_ts + i / RATE_PER_SEC
+        t0 = time.perf_counter()
+        if engine.authorize(senders[i], recipients[i], amounts[i], now=now):
+            rejected += 1
+        samples.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - begin
+
+    samples.sort()
+    mean_us = sum(samples) / len(samples) * 1e6
+    p99_us = samples[int(len(samples) * 0.99)] * 1e6
+    print(f"transfers:        {transfers}")
+    print(f"simulated rate:   {RATE_PER_SEC}/s")
+    print(f"achieved rate:    {transfers / elapsed:,.0f}/s")
+    print(f"mean per check:   {mean_us:.2f} us")
+    print(f"p99 per check:    {p99_us:.2f} us")
+    print(f"rejected:         {rejected}")
+    print(f"tracked accounts: {len(engine.accounts)}")
+    return p99_us <= BUDGET_US and transfers / elapsed >= RATE_PER_SEC
+
+
+if __name__ == '__main__':
+    ok = run(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
+    print("PASS" if ok else f"FAIL: p99 above {BUDGET_US} us or rate below {RATE_PER_SEC}/s")
+    sys.exit(0 if ok else 1)
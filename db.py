@@ -1,3 +1,16 @@
 from flask_pymongo import PyMongo
 
 mongo = PyMongo()
+
+TRANSACTION_TOPOLOGIES = ('ReplicaSetWithPrimary', 'Sharded', 'LoadBalanced')
+
+
+def supports_transactions():
+    """Whether the server can run multi-document transactions (a replica set or sharded cluster)"""
+    return mongo.cx.topology_description.topology_type_name in TRANSACTION_TOPOLOGIES
+
+
+def run_in_transaction(callback):
+    """callback(session) in one transaction, retried on transient errors. Returns its result."""
+    with mongo.cx.start_session() as session:
+        return session.with_transaction(callback)
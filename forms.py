@@ -1,13 +1,21 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField, SelectField, FloatField, HiddenField, DateField
-from wtforms.validators import DataRequired, Optional, Length, Regexp
+from flask_wtf.file import FileField, FileRequired, FileAllowed
+from wtforms import Form, StringField, PasswordField, SubmitField, SelectField, FloatField, HiddenField, DateField
+from wtforms.validators import DataRequired, Optional, Length, Regexp, ValidationError
+import math
+
+def finite(form, field):
+    """FloatField accepts 'nan' and 'inf', which compare False against every limit"""
+    if field.data is not None and not math.isfinite(field.data):
+        raise ValidationError('Enter a valid number')
 
 class LoginForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired()])
     password = PasswordField('Password', validators=[DataRequired()])
     submit = SubmitField('Login')
 
-class AddUserForm(FlaskForm):
+# Customer fields and validation rules, usable without a request context (see importer.py)
+class CustomerForm(Form):
     name = StringField('Name', validators=[DataRequired()])
     email = StringField('Email', validators=[DataRequired()])
     phone = StringField('Phone', validators=[Optional()])
@@ -15,13 +23,19 @@ class AddUserForm(FlaskForm):
     dob = DateField('Date of Birth', format='%Y-%m-%d', validators=[Optional()])
     pan = StringField('PAN Number', validators=[Optional(), Length(min=10, max=10), Regexp(r'^[A-Z]{4}\d{6}$', message='PAN must be 4 uppercase letters followed by 6 digits')])
     aadhar = StringField('Aadhar Number', validators=[Optional(), Length(min=12, max=12)])
-    initial_deposit = FloatField('Initial Deposit', validators=[DataRequired()])
+    initial_deposit = FloatField('Initial Deposit', validators=[DataRequired(), finite])
     mpin = PasswordField('MPIN', validators=[DataRequired()])
+
+class AddUserForm(FlaskForm, CustomerForm):
     submit = SubmitField('Add User')
 
+class ImportCustomersForm(FlaskForm):
+    file = FileField('Customer File (CSV or JSONL)', validators=[FileRequired(), FileAllowed(['csv', 'jsonl', 'json'], 'CSV or JSONL files only')])
+    submit = SubmitField('Import')
+
 class CreditDebitForm(FlaskForm):
     user_id = SelectField('User', choices=[], validators=[DataRequired()])
-    amount = FloatField('Amount', validators=[DataRequired()])
+    amount = FloatField('Amount', validators=[DataRequired(), finite])
     transaction_type = SelectField('Type', choices=[('credit', 'Credit'), ('debit', 'Debit')], validators=[DataRequired()])
     submit = SubmitField('Submit')
 
@@ -32,10 +46,20 @@ class ApproveRequestForm(FlaskForm):
 
 class TransferForm(FlaskForm):
     recipient = StringField('Recipient Account Number', validators=[DataRequired()])
-    amount = FloatField('Amount', validators=[DataRequired()])
+    amount = FloatField('Amount', validators=[DataRequired(), finite])
     mpin = PasswordField('MPIN', validators=[DataRequired()])
+    idempotency_key = HiddenField('Idempotency Key')
     submit = SubmitField('Transfer')
 
+class StandingInstructionForm(FlaskForm):
+    recipient = StringField('Recipient Account Number', validators=[DataRequired()])
+    amount = FloatField('Amount', validators=[DataRequired(), finite])
+    frequency = SelectField('Frequency', choices=[('daily', 'Daily'), ('weekly', 'Weekly'), ('monthly', 'Monthly')], validators=[DataRequired()])
+    first_run = DateField('First Payment Date', format='%Y-%m-%d', validators=[DataRequired()])
+    end_date = DateField('End Date', format='%Y-%m-%d', validators=[Optional()])
+    mpin = PasswordField('MPIN', validators=[DataRequired()])
+    submit = SubmitField('Set Up')
+
 class RequestForm(FlaskForm):
     request_type = SelectField('Request Type', choices=[('passbook', 'Passbook'), ('chequebook', 'Cheque Book')], validators=[DataRequired()])
     submit = SubmitField('Request')
@@ -0,0 +1,213 @@
+# End-of-day interest batch for Code Yatra Bank
+#
+# Usage: python interest.py [--date YYYY-MM-DD] [--post] [--chunk-size N]
+#
+# Streams active accounts' balances in account_no order, computes the day's
+# interest with tiered (slab) annual rates in NumPy, and adds it to each
+# user's accrued_interest. On the last day of the month (or with --post) the
+# accrued interest is posted: balance is credited and a credit Transaction
+# with method 'Interest' is written for every account that earned at least 1 paisa.
+#
+# Every update is guarded by interest_accrued_on != date and every ledger entry
+# carries an idempotency_key derived from the business date, so re-running a
+# chunk never double counts, while a mid-month --post and the month-end post
+# are separate entries. An account whose ledger entry could not be written is
+# not credited and keeps its accrued interest for the next posting. Progress
+# is checkpointed per chunk in batch_checkpoints, and an interrupted run
+# resumes after the last completed account.
+
+import argparse
+import calendar
+import sys
+from datetime import datetime, date
+
+import numpy as np
+from pymongo import MongoClient, UpdateOne, ASCENDING
+from pymongo.errors import BulkWriteError
+
+from ledger_router import LedgerRouter, read_partitions
+from models import Transaction
+
+DEFAULT_URI = "mongodb://localhost:27017/codeyatra_bank"
+DEFAULT_CHUNK_SIZE = 50000
+DAYS_PER_YEAR = 365
+
+# (lower bound of slab in INR, annual rate); each rate applies only to the part of the balance inside its slab
+RATE_TIERS = [
+    (0.0, 0.027),
+    (100000.0, 0.030),
+    (1000000.0, 0.035),
+]
+
+_TIER_LOWERS = np.array([lower for lower, _ in RATE_TIERS])
+_TIER_WIDTHS = np.append(np.diff(_TIER_LOWERS), np.inf)
+_TIER_RATES = np.array([rate for _, rate in RATE_TIERS])
+
+
+def daily_interest(balances):
+    """Vectorized one-day interest for an array of balances. Negative balances earn nothing."""
+    in_slab = np.clip(balances[:, None] - _TIER_LOWERS, 0.0, _TIER_WIDTHS)
+    return in_slab @ _TIER_RATES / DAYS_PER_YEAR
+
+
+def is_posting_day(business_date):
+    return business_date.day == calendar.monthrange(business_date.year, business_date.month)[1]
+
+
+def _load_chunk(db, after, chunk_size):
+    query = {'status': 'active', 'role': 'user'}
+    if after is not None:
+        query['account_no'] = {'$gt': after}
+    cursor = db.users.find(
+        query,
+        projection={'_id': 0, 'account_no': 1, 'balance': 1, 'accrued_interest': 1, 'interest_accrued_on': 1},
+        sort=[('account_no', ASCENDING)],
+        limit=chunk_size,
+        batch_size=chunk_size
+    )
+    return list(cursor)
+
+
+def _ledger_documents(accounts, posted, balances_after, business_date):
+    day = business_date.strftime('%Y-%m-%d')
+    timestamp = datetime.combine(business_date, datetime.max.time().replace(microsecond=0))
+    transaction_time = {
+        'date': day,
+        'time': timestamp.strftime('%H:%M:%S'),
+        'timestamp': timestamp
+    }
+    documents = []
+    for account_no, amount, balance_after in zip(accounts, posted.tolist(), balances_after.tolist()):
+        txn = Transaction(
+            f"INT{day.replace('-', '')}{account_no}", 'credit', 'admin', account_no, amount,
+            method='Interest', balance_after_transaction=balance_after,
+            transaction_time=transaction_time, idempotency_key=f"interest:{day}:{account_no}"
+        )
+        documents.append(txn.to_document())
+    return documents
+
+
+def _insert_ledger(db, documents):
+    """Write interest entries. Returns the accounts whose entry is not in the ledger."""
+    router = LedgerRouter(db, read_partitions(db))
+    unposted = set()
+    for collection, docs in router.group_placements(documents):
+        try:
+            collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            if e.details.get('writeConcernErrors'):
+                raise
+            failed = [docs[err['index']] for err in e.details.get('writeErrors', [])]
+            # A duplicate of this business date's key was written by an interrupted run and still gets credited
+            replayed = {doc['idempotency_key'] for doc in collection.find(
+                {'idempotency_key': {'$in': [doc['idempotency_key'] for doc in failed]}},
+                projection={'_id': 0, 'idempotency_key': 1})}
+            unposted.update(doc['receiver_account'] for doc in failed if doc['idempotency_key'] not in replayed)
+    return unposted
+
+
+def process_chunk(db, users, business_date, post):
+    """Accrue (and optionally post) interest for one chunk of users. Returns (accrued, posted) totals."""
+    day = business_date.strftime('%Y-%m-%d')
+    # Accounts already processed for this date (a resumed chunk) are skipped entirely
+    users = [u for u in users if u.get('interest_accrued_on') != day]
+    if not users:
+        return 0.0, 0.0
+    accounts = [u['account_no'] for u in users]
+    balances = np.fromiter((u.get('balance', 0.0) for u in users), dtype=np.float64, count=len(users))
+    accrued = np.fromiter((u.get('accrued_interest', 0.0) for u in users), dtype=np.float64, count=len(users))
+
+    today = daily_interest(balances)
+    accrued += today
+    if post:
+        posted = np.floor(accrued * 100) / 100
+        remainder = accrued - posted
+    else:
+        posted = np.zeros_like(accrued)
+        remainder = accrued
+
+    if post:
+        mask = posted > 0
+        if mask.any():
+            documents = _ledger_documents(
+                [a for a, m in zip(accounts, mask.tolist()) if m],
+                posted[mask], np.round(balances[mask] + posted[mask], 2), business_date
+            )
+            unposted = _insert_ledger(db, documents)
+            if unposted:
+                # No ledger entry, no credit: the interest stays accrued for the next posting
+                failed = np.fromiter((a in unposted for a in accounts), dtype=bool, count=len(accounts))
+                remainder[failed] = accrued[failed]
+                posted[failed] = 0.0
+
+    operations = []
+    for account_no, credit, rest in zip(accounts, posted.tolist(), remainder.tolist()):
+        update = {'$set': {'accrued_interest': rest, 'interest_accrued_on': day}}
+        if credit > 0:
+            update['$inc'] = {'balance': credit}
+            update['$set']['interest_posted_for'] = day
+        operations.append(UpdateOne({'account_no': account_no, 'interest_accrued_on': {'$ne': day}}, update))
+    db.users.bulk_write(operations, ordered=False)
+    return float(today.sum()), float(posted.sum())
+
+
+def run(uri=DEFAULT_URI, business_date=None, post=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Run (or resume) the batch for a business date. Returns a summary dict."""
+    business_date = business_date or date.today()
+    post = is_posting_day(business_date) if post is None else post
+    run_id = f"interest:{business_date.isoformat()}"
+    client = MongoClient(uri)
+    try:
+        db = client.get_default_database()
+        checkpoint = db.batch_checkpoints.find_one({'_id': run_id}) or {}
+        if checkpoint.get('done'):
+            return {'run_id': run_id, 'status': 'already complete'}
+        after = checkpoint.get('last_account')
+        accounts = checkpoint.get('accounts', 0)
+        total_accrued = checkpoint.get('accrued', 0.0)
+        total_posted = checkpoint.get('posted', 0.0)
+        while True:
+            users = _load_chunk(db, after, chunk_size)
+            if not users:
+                break
+            accrued, posted = process_chunk(db, users, business_date, post)
+            after = users[-1]['account_no']
+            accounts += len(users)
+            total_accrued += accrued
+            total_posted += posted
+            db.batch_checkpoints.update_one({'_id': run_id}, {'$set': {
+                'last_account': after,
+                'accounts': accounts,
+                'accrued': total_accrued,
+                'posted': total_posted,
+                'post': post,
+                'updated_at': datetime.utcnow()
+            }}, upsert=True)
+        db.batch_checkpoints.update_one({'_id': run_id}, {'$set': {'done': True, 'finished_at': datetime.utcnow()}}, upsert=True)
+    finally:
+        client.close()
+    return {
+        'run_id': run_id,
+        'status': 'complete',
+        'accounts': accounts,
+        'accrued': round(total_accrued, 2),
+        'posted': round(total_posted, 2),
+        'post': post
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Accrue daily interest and post it at month end.')
+    parser.add_argument('--uri', default=DEFAULT_URI)
+    parser.add_argument('--date', help='Business date (YYYY-MM-DD), defaults to today')
+    parser.add_argument('--post', action='store_true', default=None, help='Post accrued interest even if not month end')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+    business_date = datetime.strptime(args.date, '%Y-%m-%d').date() if args.date else None
+    summary = run(args.uri, business_date, args.post, args.chunk_size)
+    print(summary)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,280 @@
+# Partition-aware routing for the transaction ledger
+#
+# By default the ledger is the single `transactions` collection. With
+# app.config['LEDGER_PARTITIONS'] = N (N > 1) it is spread over N collections,
+# transactions_p00 .. transactions_pNN, by a stable hash of account number:
+#
+# - An entry's primary copy lives in its owner's partition. The owner is the
+#   sender, or the receiver when the sender is not a customer (admin credits).
+# - When the other side is a customer in a different partition, a mirror copy
+#   with the same _id and `mirror: True` is written to that partition too. Every
+#   per-account read can then be served by exactly one partition, without the
+#   sender/receiver $or spanning the whole ledger.
+# - Bank-wide reads fan out to all partitions on a thread pool, skip mirrors,
+#   and merge the results in timestamp order.
+#
+# The partition count is recorded in the ledger_meta collection the first time
+# it is used. Changing it for a non-empty ledger is refused, because existing
+# entries would no longer be found; stop the app and re-partition first with
+#
+#   python ledger_router.py migrate --partitions N [--uri URI]
+#
+# Batch jobs that open their own client (reconcile.py, interest.py) read the
+# layout from there with ledger_collections().
+
+import argparse
+import heapq
+import sys
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+
+from bson import ObjectId
+
+import ledger_writer
+
+UNPARTITIONED = 'transactions'
+PARTITION_PREFIX = 'transactions_p'
+META_ID = 'ledger_partitions'
+NON_ACCOUNTS = ('admin',)  # Counterparties that are not customer accounts
+MAX_FAN_OUT_WORKERS = 16
+DEFAULT_URI = "mongodb://localhost:27017/codeyatra_bank"
+MIGRATE_BATCH_SIZE = 10000
+STAGING_PREFIX = 'migrating_'
+BACKUP_SUFFIX = '_premigrate'
+
+router = None  # Set by init_app
+
+
+def partition_of(account_no, partitions):
+    """Stable partition number for an account (crc32, so every process agrees)"""
+    return zlib.crc32(account_no.encode('utf-8')) % partitions
+
+
+def collection_names(partitions):
+    if partitions <= 1:
+        return [UNPARTITIONED]
+    width = len(str(partitions - 1))
+    return [f"{PARTITION_PREFIX}{i:0{width}d}" for i in range(partitions)]
+
+
+def read_partitions(db):
+    """Partition count recorded for this database (0 if the ledger was never partitioned)"""
+    meta = db.ledger_meta.find_one({'_id': META_ID})
+    return meta['count'] if meta else 0
+
+
+def ledger_collections(db):
+    """Ledger collections of a database, for batch jobs that do not load the app"""
+    return [db[name] for name in collection_names(read_partitions(db))]
+
+
+class LedgerRouter:
+    """Maps ledger reads and writes onto one or more collections"""
+
+    def __init__(self, db, partitions=0):
+        self.partitions = partitions if partitions > 1 else 0
+        self.collections = [db[name] for name in collection_names(self.partitions)]
+        self.pool = ThreadPoolExecutor(max_workers=min(len(self.collections), MAX_FAN_OUT_WORKERS)) if self.partitions else None
+
+    @property
+    def partitioned(self):
+        return self.partitions > 1
+
+    def for_account(self, account_no):
+        """The collection holding every entry that involves an account"""
+        if not self.partitioned:
+            return self.collections[0]
+        return self.collections[partition_of(account_no, self.partitions)]
+
+    def placements(self, document):
+        """[(collection, document)] to write for one entry: the primary copy, then any mirror"""
+        if not self.partitioned:
+            return [(self.collections[0], document)]
+        sender, receiver = document.get('sender_account', ''), document.get('receiver_account', '')
+        owner, other = (receiver, sender) if sender in NON_ACCOUNTS else (sender, receiver)
+        primary = self.for_account(owner)
+        placements = [(primary, document)]
+        if other not in NON_ACCOUNTS:
+            secondary = self.for_account(other)
+            if secondary is not primary:
+                mirror = {k: v for k, v in document.items() if k != 'idempotency_key'}
+                mirror['mirror'] = True
+                placements.append((secondary, mirror))
+        return placements
+
+    def group_placements(self, documents):
+        """[(collection, [documents])] for a bulk write, one insert_many per partition"""
+        groups = {}
+        for document in documents:
+            document.setdefault('_id', ObjectId())
+            for collection, doc in self.placements(document):
+                groups.setdefault(collection.name, (collection, []))[1].append(doc)
+        return list(groups.values())
+
+    def insert(self, document, session=None):
+        """Write an entry to its partition(s). Returns its _id."""
+        document.setdefault('_id', ObjectId())  # Shared by the primary and the mirror
+        placements = self.placements(document)
+        # Group commit batches across requests, so it cannot join a caller's transaction; on a
+        # replica set every transfer has one, which is why group commit is a standalone-only setting
+        if session is not None or not ledger_writer.enabled:
+            for collection, doc in placements:
+                collection.insert_one(doc, session=session)
+            return document['_id']
+        # Both copies join their partitions' next group commits in parallel
+        futures = [ledger_writer.writer_for(collection).submit(doc) for collection, doc in placements]
+        try:
+            futures[0].result()
+        except Exception:
+            # The primary was rejected (e.g. duplicate idempotency key): drop a mirror that made it
+            for (collection, doc), future in zip(placements[1:], futures[1:]):
+                if future.exception() is None:
+                    collection.delete_one({'_id': doc['_id']})
+            raise
+        for future in futures[1:]:
+            future.result()
+        return document['_id']
+
+    def primary_query(self, query=None):
+        """Query restricted to primary copies, so bank-wide reads count each entry once"""
+        query = dict(query or {})
+        if self.partitioned:
+            query['mirror'] = {'$ne': True}
+        return query
+
+    def fan_out(self, fn):
+        """fn(collection) on every partition in parallel. Returns the results in partition order."""
+        if not self.partitioned:
+            return [fn(self.collections[0])]
+        return list(self.pool.map(fn, self.collections))
+
+    def find_merged(self, query=None, projection=None, sort_key='transaction_time.timestamp', direction=1):
+        """Primary copies from every partition, each sorted on the server and merged in sort_key order"""
+        if not self.partitioned:
+            return self.collections[0].find(query or {}, projection=projection).sort(sort_key, direction)
+        query = self.primary_query(query)
+        cursors = self.fan_out(lambda c: list(c.find(query, projection=projection).sort(sort_key, direction)))
+        get = _dotted_getter(sort_key)
+        return heapq.merge(*cursors, key=get, reverse=direction < 0)
+
+
+def _dotted_getter(path):
+    parts = path.split('.')
+    if len(parts) == 1:
+        return itemgetter(path)
+
+    def get(doc):
+        for part in parts:
+            doc = doc[part]
+        return doc
+    return get
+
+
+def init_app(app):
+    """Set up the router for LEDGER_PARTITIONS, recording the layout on first use"""
+    global router
+    from db import mongo
+    app.config.setdefault('LEDGER_PARTITIONS', 0)
+    partitions = app.config['LEDGER_PARTITIONS']
+    partitions = partitions if partitions > 1 else 0
+    recorded = read_partitions(mongo.db)
+    if recorded != partitions:
+        in_use = any(mongo.db[name].estimated_document_count() for name in collection_names(recorded))
+        if in_use:
+            raise RuntimeError(
+                f"Ledger has {recorded or 'no'} partitions but LEDGER_PARTITIONS is {partitions}; "
+                f"existing entries would not be found. Run: python ledger_router.py migrate --partitions {partitions}"
+            )
+        _record_partitions(mongo.db, partitions)
+    router = LedgerRouter(mongo.db, partitions)
+
+
+def _record_partitions(db, partitions):
+    db.ledger_meta.update_one({'_id': META_ID}, {'$set': {'count': partitions}}, upsert=True)
+
+
+def _copy_indexes(source, target):
+    for name, info in source.index_information().items():
+        if name == '_id_':
+            continue
+        options = {k: v for k, v in info.items() if k not in ('key', 'v', 'ns')}
+        target.create_index(info['key'], name=name, **options)
+
+
+def migrate(db, partitions, batch_size=MIGRATE_BATCH_SIZE):
+    """Re-partition the ledger into `partitions` collections. The app must be stopped. Returns entries copied."""
+    partitions = partitions if partitions > 1 else 0
+    source = LedgerRouter(db, read_partitions(db))
+    if source.partitions == partitions:
+        return 0
+    target = LedgerRouter(db, partitions)
+    existing = set(db.list_collection_names())
+    old_names = {c.name for c in source.collections}
+    for collection in target.collections:
+        if collection.name not in old_names and collection.name in existing and collection.estimated_document_count():
+            raise RuntimeError(f"{collection.name} is not part of the current ledger but is not empty")
+    # Old and new names can overlap (transactions_p0 exists for 4 and 8), so copy into staging collections first
+    staging = {c.name: db[STAGING_PREFIX + c.name] for c in target.collections}
+    for collection in staging.values():
+        collection.drop()
+        _copy_indexes(source.collections[0], collection)
+
+    copied = 0
+    for collection in source.collections:
+        # Mirrors are recreated for the new layout from their primary copies
+        batch = []
+        for document in collection.find(source.primary_query(), batch_size=batch_size):
+            batch.append(document)
+            if len(batch) >= batch_size:
+                copied += _copy_batch(target, staging, batch)
+                batch = []
+        if batch:
+            copied += _copy_batch(target, staging, batch)
+    expected = sum(c.count_documents(source.primary_query()) for c in source.collections)
+    written = sum(c.count_documents(target.primary_query()) for c in staging.values())
+    if copied != expected or written != expected:
+        raise RuntimeError(f"Copied {written} of {expected} ledger entries; the old layout is untouched")
+
+    # The old collections are kept as backups until the operator drops them
+    for collection in source.collections:
+        if collection.name in existing:
+            collection.rename(collection.name + BACKUP_SUFFIX, dropTarget=True)
+    for name, collection in staging.items():
+        collection.rename(name, dropTarget=True)
+    _record_partitions(db, partitions)
+    return copied
+
+
+def _copy_batch(target, staging, documents):
+    for collection, docs in target.group_placements(documents):
+        staging[collection.name].insert_many(docs, ordered=False)
+    return len(documents)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Re-partition the transaction ledger.')
+    parser.add_argument('command', choices=['migrate'])
+    parser.add_argument('--partitions', type=int, required=True, help='New partition count (0 or 1 for a single collection)')
+    parser.add_argument('--uri', default=DEFAULT_URI)
+    parser.add_argument('--batch-size', type=int, default=MIGRATE_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    from pymongo import MongoClient
+    partitions = args.partitions if args.partitions > 1 else 0
+    client = MongoClient(args.uri)
+    try:
+        db = client.get_default_database()
+        before = read_partitions(db)
+        if before == partitions:
+            print(f"Ledger already has {before or 'no'} partitions")
+            return 0
+        copied = migrate(db, partitions, args.batch_size)
+    finally:
+        client.close()
+    print(f"Moved {copied} entries from {before or 'no'} to {partitions or 'no'} partitions")
+    print(f"The old collections were renamed with the suffix {BACKUP_SUFFIX}; drop them once the app runs correctly")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+# Group-commit writer for the transaction ledger
+#
+# Off by default. With app.config['LEDGER_GROUP_COMMIT'] = True, Transaction.save
+# hands its document to a background flusher instead of calling insert_one.
+# The flusher collects documents from concurrent requests for up to
+# LEDGER_GROUP_COMMIT_DELAY_MS (or until LEDGER_GROUP_COMMIT_MAX_BATCH are
+# waiting) and writes them with one insert_many using a journaled write
+# concern. Each caller blocks until its own document is on the journal, so a
+# transfer is never acknowledged before its ledger entry is durable.
+# A partitioned ledger (see ledger_router.py) gets one writer per partition.
+#
+# Group commit only applies to writes made outside a transaction. On a replica
+# set, transfers, credits and debits write their ledger entry inside a
+# multi-document transaction (see db.run_in_transaction), which cannot share
+# a batch with other requests, so those entries bypass the writer and commit
+# with their transaction. In practice the setting only helps standalone servers.
+
+import atexit
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from pymongo import WriteConcern
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+DEFAULT_DELAY_MS = 2.0
+DEFAULT_MAX_BATCH = 500
+JOURNALED = WriteConcern(w=1, j=True)
+
+enabled = False  # Set by init_app
+_settings = {}
+_writers = {}  # Collection name -> GroupCommitWriter
+_writers_lock = threading.Lock()
+
+
+class GroupCommitWriter:
+    """Batches ledger inserts from many threads into journaled insert_many calls"""
+
+    def __init__(self, collection, delay_ms=DEFAULT_DELAY_MS, max_batch=DEFAULT_MAX_BATCH):
+        self.collection = collection.with_options(write_concern=JOURNALED)
+        self.delay = delay_ms / 1000.0
+        self.max_batch = max_batch
+        self.pending = []  # (document, Future)
+        self.cond = threading.Condition()
+        self.closed = False
+        self.thread = None
+        self.pid = None
+        # Counters for the benchmark and for monitoring
+        self.batches = 0
+        self.documents = 0
+
+    def _ensure_thread(self):
+        # Started lazily (and restarted after fork) so pre-forking servers get a flusher per worker
+        if self.thread is None or self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._run, name='ledger-group-commit', daemon=True)
+            self.thread.start()
+
+    def submit(self, document):
+        """Queue a document. The returned Future resolves to its _id once the batch is journaled."""
+        future = Future()
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("Ledger writer is closed")
+            self._ensure_thread()
+            self.pending.append((document, future))
+            self.cond.notify()
+        return future
+
+    def write(self, document):
+        """Insert one document through the next batch and wait for it to be durable"""
+        return self.submit(document).result()
+
+    def _next_batch(self):
+        with self.cond:
+            while not self.pending and not self.closed:
+                self.cond.wait()
+            if not self.pending:
+                return None
+            # Give concurrent requests a short window to join this batch
+            deadline = time.monotonic() + self.delay
+            while len(self.pending) < self.max_batch and not self.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            batch = self.pending[:self.max_batch]
+            del self.pending[:self.max_batch]
+            return batch
+
+    def _flush(self, batch):
+        documents = [document for document, _ in batch]
+        failed = {}
+        try:
+            self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for err in e.details.get('writeErrors', []):
+                error_class = DuplicateKeyError if err.get('code') == 11000 else OperationFailure
+                failed[err['index']] = error_class(err.get('errmsg', 'write failed'), err.get('code'), err)
+            concern_errors = e.details.get('writeConcernErrors')
+            if concern_errors:
+                # Durability of the whole batch is unknown, so nobody is acknowledged
+                error = OperationFailure(concern_errors[0].get('errmsg', 'write concern failed'), concern_errors[0].get('code'))
+                failed = {i: error for i in range(len(batch))}
+        except Exception as e:
+            failed = {i: e for i in range(len(batch))}
+        self.batches += 1
+        self.documents += len(batch)
+        for i, (document, future) in enumerate(batch):
+            if i in failed:
+                future.set_exception(failed[i])
+            else:
+                future.set_result(document['_id'])
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._flush(batch)
+
+    def close(self):
+        """Flush whatever is queued and stop the flusher"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        if self.thread is not None and self.pid == os.getpid():
+            self.thread.join()
+
+
+def writer_for(collection):
+    """The group-commit writer for a ledger collection, created on first use"""
+    writer = _writers.get(collection.name)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(collection.name)
+            if writer is None:
+                writer = GroupCommitWriter(collection, **_settings)
+                _writers[collection.name] = writer
+                atexit.register(writer.close)
+    return writer
+
+
+def init_app(app):
+    """Enable group commit if LEDGER_GROUP_COMMIT is set"""
+    global enabled
+    app.config.setdefault('LEDGER_GROUP_COMMIT', False)
+    app.config.setdefault('LEDGER_GROUP_COMMIT_DELAY_MS', DEFAULT_DELAY_MS)
+    app.config.setdefault('LEDGER_GROUP_COMMIT_MAX_BATCH', DEFAULT_MAX_BATCH)
+    enabled = bool(app.config['LEDGER_GROUP_COMMIT'])
+    _settings.update(
+        delay_ms=app.config['LEDGER_GROUP_COMMIT_DELAY_MS'],
+        max_batch=app.config['LEDGER_GROUP_COMMIT_MAX_BATCH']
+    )
@@ -1,19 +1,29 @@
 import bcrypt
+import math
 import random
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from flask_login import UserMixin
 from db import mongo
+import ledger_router
+import account_filter
 from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 
 # User Model for regular users
 # Collection: users
-# Fields: account_no (unique), name, email, mpin, balance, role ('user'), status, created_at
+# Fields: account_no (unique), name, email, mpin, mpin_hash (imported customers), balance, opening_balance, role ('user'), status, created_at
 class User(UserMixin):
-    def __init__(self, account_no, name, email, mpin, balance=0.0, role='user', status='active', created_at=None, first_login=True, phone='', address='', ifsc_code='', micr_code='', cif_no='', dob=None, pan='', aadhar=''):
+    ACCOUNT_BLOCK_BASE = 2000000000  # Block-allocated account numbers start above this
+    ACCOUNT_BLOCK_SIZE = 1000000000  # ...and stay below ACCOUNT_BLOCK_BASE + this; random numbers skip the range
+    SAVE_ATTEMPTS = 5
+
+    def __init__(self, account_no, name, email, mpin, balance=0.0, role='user', status='active', created_at=None, first_login=True, phone='', address='', ifsc_code='', micr_code='', cif_no='', dob=None, pan='', aadhar='', mpin_hash=None):
         self.account_no = account_no  # Unique account number
         self.name = name
         self.email = email
         self.mpin = mpin  # Store plain text MPIN
+        self.mpin_hash = mpin_hash  # bcrypt hash instead of mpin, for imported customers
         self.balance = balance
         self.role = role  # 'user'
         self.status = status  # 'active', 'inactive', etc.
@@ -30,7 +40,19 @@ class User(UserMixin):
 
     @staticmethod
     def generate_account_number():
-        return str(random.randint(1000000000, 9999999999))
+        while True:
+            number = random.randint(1000000000, 9999999999 - User.ACCOUNT_BLOCK_SIZE)
+            if number > User.ACCOUNT_BLOCK_BASE:
+                number += User.ACCOUNT_BLOCK_SIZE  # Skip the block-allocation range
+            account_no = str(number)
+            if account_filter.accounts.bloom is None:
+                # Filter not built (e.g. a script outside the app): ask the database
+                taken = User.exists(account_no)
+            else:
+                # Numbers the filter says may be taken are skipped without a DB lookup
+                taken = account_filter.accounts.might_exist(account_no)
+            if not taken:
+                return account_no
 
     @staticmethod
     def generate_ifsc_code():
@@ -44,19 +66,58 @@ class User(UserMixin):
     def generate_cif_no():
         return str(random.randint(100000000, 999999999))
 
+    @staticmethod
+    def ensure_indexes():
+        """Account numbers must be unique"""
+        mongo.db.users.create_index([('account_no', ASCENDING)], unique=True)
+
+    @staticmethod
+    def allocate_account_numbers(count):
+        """Reserve a contiguous block of `count` account numbers with one counter update"""
+        counter = mongo.db.counters.find_one_and_update(
+            {'_id': 'account_no'},
+            {'$inc': {'seq': count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        last = User.ACCOUNT_BLOCK_BASE + counter['seq']
+        return [str(n) for n in range(last - count + 1, last + 1)]
+
+    @staticmethod
+    def hash_mpin(mpin, rounds=12):
+        """bcrypt hash of an MPIN, as stored in mpin_hash for imported customers"""
+        return bcrypt.hashpw(mpin.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
     def save(self):
         """Save user to MongoDB users collection"""
+        mongo.db.users.insert_one(self.to_document())
+        account_filter.accounts.add(self.account_no)
+
+    def save_new_account(self):
+        """Save under a freshly generated account number, drawing again if another process took it first"""
+        for attempt in range(User.SAVE_ATTEMPTS):
+            self.account_no = User.generate_account_number()
+            try:
+                self.save()
+                return self.account_no
+            except DuplicateKeyError:
+                if attempt == User.SAVE_ATTEMPTS - 1:
+                    raise
+
+    def to_document(self):
+        """User as stored in the users collection"""
         # Convert dob to datetime if it's a date object
         dob_to_save = self.dob
         if isinstance(dob_to_save, date) and not isinstance(dob_to_save, datetime):
             dob_to_save = datetime.combine(dob_to_save, datetime.min.time())
 
-        mongo.db.users.insert_one({
+        document = {
             'account_no': self.account_no,
             'name': self.name,
             'email': self.email,
             'mpin': self.mpin,
             'balance': self.balance,
+            'opening_balance': self.balance,  # Deposit with no ledger entry, used by reconcile.py
             'role': self.role,
             'status': self.status,
             'created_at': self.created_at,
@@ -69,15 +130,37 @@ class User(UserMixin):
             'dob': dob_to_save,
             'pan': self.pan,
             'aadhar': self.aadhar
-        })
-
-    def update_balance(self, amount):
-        """Update user balance"""
-        self.balance += amount
-        mongo.db.users.update_one({'account_no': self.account_no}, {'$set': {'balance': self.balance}})
+        }
+        if self.mpin_hash:
+            document['mpin_hash'] = self.mpin_hash
+        return document
+
+    def update_balance(self, amount, session=None):
+        """
+        Atomically add amount to the balance and refresh self.balance.
+        A debit only applies if the stored balance covers it. Returns whether it applied.
+        """
+        # NaN passes every comparison guard and would poison the stored balance
+        if not math.isfinite(amount):
+            return False
+        query = {'account_no': self.account_no}
+        if amount < 0:
+            query['balance'] = {'$gte': -amount}
+        updated = mongo.db.users.find_one_and_update(
+            query,
+            {'$inc': {'balance': amount}},
+            projection={'_id': 0, 'balance': 1},
+            session=session
+        )
+        if updated is None:
+            return False
+        self.balance = updated.get('balance', 0.0) + amount  # Pre-update balance plus the same $inc
+        return True
 
     def check_mpin(self, mpin):
-        """Check MPIN"""
+        """Check MPIN (plain text, or bcrypt hash for imported customers)"""
+        if self.mpin_hash:
+            return bcrypt.checkpw(mpin.encode('utf-8'), self.mpin_hash.encode('utf-8'))
         return self.mpin == mpin
 
     def set_first_login(self, value):
@@ -110,11 +193,31 @@ class User(UserMixin):
                 cif_no=user_data.get('cif_no', ''),
                 dob=user_data.get('dob'),
                 pan=user_data.get('pan', ''),
-                aadhar=user_data.get('aadhar', '')
+                aadhar=user_data.get('aadhar', ''),
+                mpin_hash=user_data.get('mpin_hash')
             )
             return user
         return None
 
+    @staticmethod
+    def get_balance(account_no):
+        """Current balance of an account, or None if it does not exist"""
+        user_data = mongo.db.users.find_one({'account_no': account_no}, projection={'_id': 0, 'balance': 1})
+        return user_data.get('balance', 0.0) if user_data else None
+
+    @staticmethod
+    def contacts_for(account_nos):
+        """{account_no: {'name', 'email'}} for the given accounts, in one query"""
+        return {
+            user['account_no']: user
+            for user in mongo.db.users.find({'account_no': {'$in': list(account_nos)}}, projection={'_id': 0, 'account_no': 1, 'name': 1, 'email': 1})
+        }
+
+    @staticmethod
+    def exists(account_no):
+        """Whether an account number is in use"""
+        return mongo.db.users.find_one({'account_no': account_no}, projection={'_id': 1}) is not None
+
     @staticmethod
     def find_all():
         """Find all users"""
@@ -133,9 +236,9 @@ class User(UserMixin):
 
 # Transaction Model
 # Collection: transactions
-# Fields: transaction_id, type, sender_account, receiver_account, amount, currency, status, method, description, balance_after_transaction, transaction_time
+# Fields: transaction_id, type, sender_account, receiver_account, amount, currency, status, method, description, balance_after_transaction, transaction_time, idempotency_key (optional)
 class Transaction:
-    def __init__(self, transaction_id, txn_type, sender_account, receiver_account, amount, currency='INR', status='success', method='Transfer', balance_after_transaction=0.0, transaction_time=None):
+    def __init__(self, transaction_id, txn_type, sender_account, receiver_account, amount, currency='INR', status='success', method='Transfer', balance_after_transaction=0.0, transaction_time=None, idempotency_key=None):
         self.transaction_id = transaction_id  # Unique transaction ID like "CODE2025100812"
         self.txn_type = txn_type  # 'credit', 'debit', 'transfer'
         self.sender_account = sender_account
@@ -143,17 +246,23 @@ class Transaction:
         self.amount = amount
         self.currency = currency  # 'INR'
         self.status = status  # 'success', 'failed', 'pending'
-        self.method = method  # 'UPI', 'NEFT', 'IMPS', 'QR', 'Cash', 'Transfer', 'Cash Submit in Bank'
+        self.method = method  # 'UPI', 'NEFT', 'IMPS', 'QR', 'Cash', 'Transfer', 'Cash Submit in Bank', 'Interest'
         self.balance_after_transaction = balance_after_transaction  # Sender's balance after transaction
         self.transaction_time = transaction_time or {
             'date': datetime.utcnow().strftime('%Y-%m-%d'),
             'time': datetime.utcnow().strftime('%H:%M:%S'),
             'timestamp': datetime.utcnow()
         }
+        self.idempotency_key = idempotency_key  # Client request key, set for retry-safe transfers
 
-    def save(self):
-        """Save transaction to MongoDB transactions collection"""
-        return mongo.db.transactions.insert_one({
+    def save(self, session=None):
+        """Save transaction to MongoDB transactions collection (or its partitions)"""
+        # With group commit enabled this returns once the batch holding the entry is journaled
+        return ledger_router.router.insert(self.to_document(), session=session)
+
+    def to_document(self):
+        """Transaction as stored in the transactions collection"""
+        txn_data = {
             'transaction_id': self.transaction_id,
             'type': self.txn_type,
             'sender_account': self.sender_account,
@@ -164,25 +273,115 @@ class Transaction:
             'method': self.method,
             'balance_after_transaction': self.balance_after_transaction,
             'transaction_time': self.transaction_time
-        }).inserted_id
+        }
+        if self.idempotency_key:
+            txn_data['idempotency_key'] = self.idempotency_key
+        return txn_data
 
     @staticmethod
-    def find_by_user(account_no):
-        """Find transactions for a user (as sender or receiver)"""
-        return list(mongo.db.transactions.find({
+    def find_by_idempotency_key(key, account_no=None):
+        """Find the ledger entry written for an idempotency key, in the sender's partition when account_no is given"""
+        router = ledger_router.router
+        if account_no is not None:
+            return router.for_account(account_no).find_one({'idempotency_key': key})
+        for found in router.fan_out(lambda c: c.find_one({'idempotency_key': key})):
+            if found:
+                return found
+        return None
+
+    @staticmethod
+    def _user_query(account_no):
+        return {
             '$or': [
                 {'sender_account': account_no},
                 {'receiver_account': account_no}
             ]
-        }))
+        }
+
+    @staticmethod
+    def find_by_user(account_no):
+        """Find transactions for a user (as sender or receiver)"""
+        return list(ledger_router.router.for_account(account_no).find(Transaction._user_query(account_no)))
 
     @staticmethod
     def find_all():
         """Find all transactions"""
-        return list(mongo.db.transactions.find())
+        router = ledger_router.router
+        if not router.partitioned:
+            return list(router.collections[0].find())
+        return list(router.find_merged())
 
     @staticmethod
-    def record_transaction(sender_acc, receiver_acc, amount, txn_type, method='Transfer', balance_after=0.0, status='success'):
+    def ensure_indexes():
+        """Indexes for per-user history read newest first, and for time-ordered bank-wide reads"""
+        for collection in ledger_router.router.collections:
+            collection.create_index([('sender_account', ASCENDING), ('_id', DESCENDING)])
+            collection.create_index([('receiver_account', ASCENDING), ('_id', DESCENDING)])
+            if ledger_router.router.partitioned:
+                collection.create_index([('transaction_time.timestamp', ASCENDING)])
+
+    @staticmethod
+    def find_page_for_user(account_no, limit, before=None, projection=None):
+        """Up to `limit` of a user's transactions, newest first, with _id below `before` when given"""
+        query = Transaction._user_query(account_no)
+        if before is not None:
+            query['_id'] = {'$lt': before}
+        collection = ledger_router.router.for_account(account_no)
+        return list(collection.find(query, projection=projection).sort('_id', DESCENDING).limit(limit))
+
+    @staticmethod
+    def stats_for_user(account_no):
+        """Count and first/last timestamps of a user's transactions"""
+        rows = list(ledger_router.router.for_account(account_no).aggregate([
+            {'$match': Transaction._user_query(account_no)},
+            {'$group': {
+                '_id': None,
+                'count': {'$sum': 1},
+                'first': {'$min': '$transaction_time.timestamp'},
+                'last': {'$max': '$transaction_time.timestamp'}
+            }}
+        ]))
+        if not rows:
+            return {'count': 0, 'first': None, 'last': None}
+        return {'count': rows[0]['count'], 'first': rows[0]['first'], 'last': rows[0]['last']}
+
+    @staticmethod
+    def find_transfers_since(since):
+        """Transfers since a datetime, oldest first, with only the fields velocity checks need"""
+        return ledger_router.router.find_merged(
+            {'type': 'transfer', 'transaction_time.timestamp': {'$gte': since}},
+            projection={'_id': 0, 'sender_account': 1, 'receiver_account': 1, 'amount': 1, 'transaction_time.timestamp': 1}
+        )
+
+    @staticmethod
+    def recipients_by_sender_since(since):
+        """Yield (sender_account, [receiver_account, ...]) for transfers since a datetime"""
+        router = ledger_router.router
+        # A sender's primary entries all live in its own partition, so per-partition groups are complete
+        pipeline = [
+            {'$match': router.primary_query({'type': 'transfer', 'transaction_time.timestamp': {'$gte': since}})},
+            {'$group': {'_id': '$sender_account', 'recipients': {'$addToSet': '$receiver_account'}}}
+        ]
+        for rows in router.fan_out(lambda c: list(c.aggregate(pipeline, allowDiskUse=True))):
+            for row in rows:
+                yield row['_id'], row['recipients']
+
+    @staticmethod
+    def latest_id_for_user(account_no):
+        """_id of the newest transaction involving a user, or None"""
+        latest = ledger_router.router.for_account(account_no).find_one(
+            Transaction._user_query(account_no), projection={'_id': 1}, sort=[('_id', -1)])
+        return latest['_id'] if latest else None
+
+    @staticmethod
+    def latest_id():
+        """_id of the newest transaction in the ledger, or None"""
+        ids = [latest['_id'] for latest in ledger_router.router.fan_out(
+            lambda c: c.find_one({}, projection={'_id': 1}, sort=[('_id', -1)])) if latest]
+        return max(ids) if ids else None
+
+    @staticmethod
+    def record_transaction(sender_acc, receiver_acc, amount, txn_type, method='Transfer', balance_after=0.0, status='success', idempotency_key=None, session=None):
         """Record a new transaction"""
         now = datetime.utcnow()
         import random
@@ -192,14 +391,84 @@ class Transaction:
             'time': now.strftime('%H:%M:%S'),
             'timestamp': now
         }
-        txn = Transaction(transaction_id, txn_type, sender_acc, receiver_acc, amount, currency='INR', status=status, method=method, balance_after_transaction=balance_after, transaction_time=transaction_time)
-        txn.save()
+        txn = Transaction(transaction_id, txn_type, sender_acc, receiver_acc, amount, currency='INR', status=status, method=method, balance_after_transaction=balance_after, transaction_time=transaction_time, idempotency_key=idempotency_key)
+        txn.inserted_id = txn.save(session)  # Unique, unlike transaction_id; used to dedupe notifications
         return txn
 
+# Idempotency Model
+# Collection: idempotency
+# Fields: key (unique), account_no, status ('pending'/'completed'), result, transaction_id, locked_until, created_at (TTL)
+class IdempotencyKey:
+    TTL_SECONDS = 24 * 60 * 60  # Keys are remembered for one day
+    LEASE_SECONDS = 60  # A pending key older than this belongs to a request that died
+
+    @staticmethod
+    def ensure_indexes():
+        """Create the unique key index and the TTL index on created_at"""
+        mongo.db.idempotency.create_index([('key', ASCENDING)], unique=True)
+        mongo.db.idempotency.create_index([('created_at', ASCENDING)], expireAfterSeconds=IdempotencyKey.TTL_SECONDS)
+        # Keys belong to the sender, whose partition holds the primary copy, so per-partition uniqueness is enough
+        for collection in ledger_router.router.collections:
+            collection.create_index([('idempotency_key', ASCENDING)], unique=True, sparse=True)
+
+    @staticmethod
+    def reserve(key, account_no):
+        """
+        Claim a key before executing a request.
+        Returns None if the key was newly claimed, otherwise the existing record.
+        """
+        now = datetime.utcnow()
+        try:
+            mongo.db.idempotency.insert_one({
+                'key': key,
+                'account_no': account_no,
+                'status': 'pending',
+                'result': None,
+                'transaction_id': None,
+                'locked_until': now + timedelta(seconds=IdempotencyKey.LEASE_SECONDS),
+                'created_at': now
+            })
+            return None
+        except DuplicateKeyError:
+            return mongo.db.idempotency.find_one({'key': key})
+
+    @staticmethod
+    def _abandoned(key, now):
+        """Filter for a key still pending after its lease ran out (records from before leases use created_at)"""
+        return {'key': key, 'status': 'pending', '$or': [
+            {'locked_until': {'$lt': now}},
+            {'locked_until': None, 'created_at': {'$lt': now - timedelta(seconds=IdempotencyKey.LEASE_SECONDS)}}
+        ]}
+
+    @staticmethod
+    def lease_expired(record, now):
+        locked_until = record.get('locked_until') or record['created_at'] + timedelta(seconds=IdempotencyKey.LEASE_SECONDS)
+        return locked_until < now
+
+    @staticmethod
+    def take_over(key, now):
+        """Atomically renew an abandoned key's lease for a retry. Returns whether this caller got it."""
+        return mongo.db.idempotency.find_one_and_update(
+            IdempotencyKey._abandoned(key, now),
+            {'$set': {'locked_until': now + timedelta(seconds=IdempotencyKey.LEASE_SECONDS)}}
+        ) is not None
+
+    @staticmethod
+    def complete(key, result, transaction_id=None, session=None):
+        """Store the outcome of the request made with this key, unless it is already completed. Returns whether it did."""
+        return mongo.db.idempotency.update_one({'key': key, 'status': 'pending'}, {'$set': {
+            'status': 'completed',
+            'result': result,
+            'transaction_id': transaction_id
+        }}, session=session).modified_count == 1
+
 # Request Model
 # Collection: requests
 # Fields: req_id, acc_no, type ('passbook'/'chequebook'), status, created_at
 class Request:
+    STATUSES = ('pending', 'approved', 'rejected')
+    FINAL_STATUSES = ('approved', 'rejected')  # Only pending requests may move to these
+
     def __init__(self, req_id, acc_no, req_type, status='pending', created_at=None):
         self.req_id = req_id  # Unique request ID
         self.acc_no = acc_no
@@ -222,16 +491,78 @@ class Request:
         self.status = status
         mongo.db.requests.update_one({'req_id': self.req_id}, {'$set': {'status': status}})
 
+    @staticmethod
+    def ensure_indexes():
+        """Index for the status-filtered, date-ordered request queue"""
+        mongo.db.requests.create_index([('status', ASCENDING), ('created_at', ASCENDING)])
+        mongo.db.requests.create_index([('req_id', ASCENDING)])
+        mongo.db.requests.create_index([('acc_no', ASCENDING)])
+        mongo.db.requests.create_index([('batch_id', ASCENDING)], sparse=True)
+
     @staticmethod
     def find_all():
         """Find all requests"""
         return list(mongo.db.requests.find())
 
+    @staticmethod
+    def find_by_status(status, page=1, per_page=50):
+        """One page of requests with a status, oldest first"""
+        return list(mongo.db.requests.find({'status': status})
+                    .sort('created_at', ASCENDING)
+                    .skip((page - 1) * per_page)
+                    .limit(per_page))
+
+    @staticmethod
+    def count_by_status(status):
+        """Number of requests with a status"""
+        return mongo.db.requests.count_documents({'status': status})
+
+    @staticmethod
+    def transition(req_ids, status, batch_id=None):
+        """
+        Move pending requests to approved/rejected in a single update_many.
+        Requests that are no longer pending are left alone. Returns how many changed.
+        The changed requests are tagged with batch_id, if given, for find_by_batch.
+        """
+        if status not in Request.FINAL_STATUSES:
+            raise ValueError(f"Invalid request status: {status}")
+        return mongo.db.requests.update_many(
+            {'req_id': {'$in': list(req_ids)}, 'status': 'pending'},
+            {'$set': Request._transition_fields(status, batch_id)}
+        ).modified_count
+
+    @staticmethod
+    def transition_all_pending(status, batch_id=None):
+        """Move every pending request to approved/rejected. Returns how many changed."""
+        if status not in Request.FINAL_STATUSES:
+            raise ValueError(f"Invalid request status: {status}")
+        return mongo.db.requests.update_many(
+            {'status': 'pending'},
+            {'$set': Request._transition_fields(status, batch_id)}
+        ).modified_count
+
+    @staticmethod
+    def _transition_fields(status, batch_id):
+        fields = {'status': status, 'updated_at': datetime.utcnow()}
+        if batch_id is not None:
+            fields['batch_id'] = batch_id
+        return fields
+
+    @staticmethod
+    def find_by_batch(batch_id):
+        """Requests changed by one transition call"""
+        return list(mongo.db.requests.find({'batch_id': batch_id}, projection={'_id': 0, 'req_id': 1, 'acc_no': 1, 'type': 1, 'status': 1}))
+
     @staticmethod
     def find_by_id(req_id):
         """Find request by ID"""
         return mongo.db.requests.find_one({'req_id': req_id})
 
+    @staticmethod
+    def find_by_account(account_no):
+        """Find all requests raised by an account"""
+        return list(mongo.db.requests.find({'acc_no': account_no}))
+
     @staticmethod
     def log_request(acc_no, req_type):
         """Log a new request"""
@@ -240,6 +571,200 @@ class Request:
         req.save()
         return req
 
+# Standing Instruction Model
+# Collection: standing_instructions
+# Fields: si_id, sender_account, recipient_account, amount, frequency ('daily'/'weekly'/'monthly'), next_run, first_run,
+#         scheduled_for, end_date, status ('active'/'cancelled'/'completed'), attempt, locked_until, last_result, last_run_at, created_at
+# Collection: standing_instruction_runs (one row per execution attempt)
+class StandingInstruction:
+    FREQUENCIES = ('daily', 'weekly', 'monthly')
+
+    def __init__(self, si_id, sender_account, recipient_account, amount, frequency='monthly', next_run=None, end_date=None, status='active', created_at=None):
+        self.si_id = si_id
+        self.sender_account = sender_account
+        self.recipient_account = recipient_account
+        self.amount = amount
+        self.frequency = frequency
+        self.next_run = next_run or datetime.utcnow()
+        self.end_date = end_date
+        self.status = status
+        self.created_at = created_at or datetime.utcnow()
+
+    def save(self):
+        """Save standing instruction to MongoDB standing_instructions collection"""
+        return mongo.db.standing_instructions.insert_one({
+            'si_id': self.si_id,
+            'sender_account': self.sender_account,
+            'recipient_account': self.recipient_account,
+            'amount': self.amount,
+            'frequency': self.frequency,
+            'next_run': self.next_run,
+            'first_run': self.next_run,  # Anchors the day of month for monthly instructions
+            'scheduled_for': self.next_run,  # Period being paid; next_run moves ahead of it on retries
+            'end_date': self.end_date,
+            'status': self.status,
+            'attempt': 0,
+            'locked_until': None,
+            'last_result': None,
+            'last_run_at': None,
+            'created_at': self.created_at
+        }).inserted_id
+
+    @staticmethod
+    def ensure_indexes():
+        """Next-run index used by the scheduler, plus per-account and id lookups"""
+        mongo.db.standing_instructions.create_index([('status', ASCENDING), ('next_run', ASCENDING)])
+        mongo.db.standing_instructions.create_index([('sender_account', ASCENDING)])
+        mongo.db.standing_instructions.create_index([('si_id', ASCENDING)], unique=True)
+
+    @staticmethod
+    def create(sender_account, recipient_account, amount, frequency, first_run, end_date=None):
+        """Create a new active standing instruction"""
+        si = StandingInstruction(str(ObjectId()), sender_account, recipient_account, amount, frequency, first_run, end_date)
+        si.save()
+        return si
+
+    @staticmethod
+    def find_by_account(account_no):
+        """All standing instructions set up by an account, newest first"""
+        return list(mongo.db.standing_instructions.find({'sender_account': account_no}).sort('created_at', -1))
+
+    @staticmethod
+    def cancel(si_id, account_no):
+        """Cancel an active instruction owned by account_no"""
+        return mongo.db.standing_instructions.update_one(
+            {'si_id': si_id, 'sender_account': account_no, 'status': 'active'},
+            {'$set': {'status': 'cancelled'}}
+        ).modified_count == 1
+
+    @staticmethod
+    def find_due(now, limit):
+        """Active instructions due by `now` and not leased by another scheduler, earliest first"""
+        return list(mongo.db.standing_instructions.find(
+            {'status': 'active', 'next_run': {'$lte': now}, '$or': [{'locked_until': None}, {'locked_until': {'$lt': now}}]},
+            projection={'_id': 0, 'si_id': 1, 'next_run': 1}
+        ).sort('next_run', ASCENDING).limit(limit))
+
+    @staticmethod
+    def claim(si_id, now, lease_seconds):
+        """Atomically lease a due instruction. Returns the document, or None if someone else has it."""
+        return mongo.db.standing_instructions.find_one_and_update(
+            {'si_id': si_id, 'status': 'active', 'next_run': {'$lte': now},
+             '$or': [{'locked_until': None}, {'locked_until': {'$lt': now}}]},
+            {'$set': {'locked_until': now + timedelta(seconds=lease_seconds)}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    @staticmethod
+    def finish(si_id, next_run, scheduled_for, attempt, status, result, now):
+        """Release the lease and schedule the next run"""
+        mongo.db.standing_instructions.update_one({'si_id': si_id}, {'$set': {
+            'next_run': next_run,
+            'scheduled_for': scheduled_for,
+            'attempt': attempt,
+            'status': status,
+            'locked_until': None,
+            'last_result': result,
+            'last_run_at': now
+        }})
+
+    @staticmethod
+    def log_run(si_id, due, attempt, result, idempotency_key):
+        """Record the outcome of one execution attempt"""
+        mongo.db.standing_instruction_runs.insert_one({
+            'si_id': si_id,
+            'due': due,
+            'attempt': attempt,
+            'result': result,
+            'idempotency_key': idempotency_key,
+            'run_at': datetime.utcnow()
+        })
+
+# Notification Outbox Model
+# Collection: outbox
+# Fields: _id (dedupe key), account_no, kind, subject, body, status ('pending'/'sending'/'sent'/'failed'),
+#         attempts, next_attempt_at, lease_id, locked_until, last_error, created_at, sent_at
+class Notification:
+    SENT_TTL_SECONDS = 30 * 24 * 60 * 60  # Delivered rows are kept for 30 days
+
+    @staticmethod
+    def ensure_indexes():
+        """Index for the dispatcher's due-row scan, and expiry of delivered rows"""
+        mongo.db.outbox.create_index([('status', ASCENDING), ('next_attempt_at', ASCENDING)])
+        mongo.db.outbox.create_index([('sent_at', ASCENDING)], expireAfterSeconds=Notification.SENT_TTL_SECONDS, sparse=True)
+
+    @staticmethod
+    def build(key, account_no, kind, subject, body, now=None):
+        """Outbox row for one message. Rows with the same key are only ever queued once."""
+        now = now or datetime.utcnow()
+        return {
+            '_id': key,
+            'account_no': account_no,
+            'kind': kind,
+            'subject': subject,
+            'body': body,
+            'status': 'pending',
+            'attempts': 0,
+            'next_attempt_at': now,
+            'created_at': now
+        }
+
+    @staticmethod
+    def enqueue(rows, session=None):
+        """
+        Queue rows in one insert_many. Duplicates of already queued keys are dropped. Returns how many were new.
+        With a session the rows commit or roll back with the caller's transaction.
+        """
+        if not rows:
+            return 0
+        try:
+            return len(mongo.db.outbox.insert_many(rows, ordered=False, session=session).inserted_ids)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            if any(err.get('code') != 11000 for err in errors):
+                raise
+            return len(rows) - len(errors)
+
+    @staticmethod
+    def claim_batch(limit, now, lease_seconds):
+        """Lease up to `limit` due rows, including ones whose previous lease expired. Returns the leased rows."""
+        due = {'$or': [
+            {'status': 'pending', 'next_attempt_at': {'$lte': now}},
+            {'status': 'sending', 'locked_until': {'$lt': now}}
+        ]}
+        ids = [row['_id'] for row in mongo.db.outbox.find(due, projection={'_id': 1}).sort('next_attempt_at', ASCENDING).limit(limit)]
+        if not ids:
+            return []
+        lease_id = ObjectId()
+        # Re-checking `due` makes the lease atomic per row against other dispatchers
+        mongo.db.outbox.update_many(
+            {'$and': [{'_id': {'$in': ids}}, due]},
+            {'$set': {'status': 'sending', 'lease_id': lease_id, 'locked_until': now + timedelta(seconds=lease_seconds)}}
+        )
+        return list(mongo.db.outbox.find({'lease_id': lease_id}))
+
+    @staticmethod
+    def mark_sent(keys, now):
+        if keys:
+            mongo.db.outbox.update_many(
+                {'_id': {'$in': list(keys)}},
+                {'$set': {'status': 'sent', 'sent_at': now}, '$inc': {'attempts': 1}, '$unset': {'lease_id': '', 'locked_until': ''}}
+            )
+
+    @staticmethod
+    def mark_retry(key, next_attempt_at, error):
+        mongo.db.outbox.update_one(
+            {'_id': key},
+            {'$set': {'status': 'pending', 'next_attempt_at': next_attempt_at, 'last_error': error}, '$inc': {'attempts': 1}, '$unset': {'lease_id': '', 'locked_until': ''}}
+        )
+
+    @staticmethod
+    def mark_failed(key, error):
+        mongo.db.outbox.update_one(
+            {'_id': key},
+            {'$set': {'status': 'failed', 'last_error': error}, '$inc': {'attempts': 1}, '$unset': {'lease_id': '', 'locked_until': ''}}
+        )
+
 # QR Transfer Model (optional)
 # Collection: qr_transfers
 # Fields: qr_id, sender_acc, receiver_acc, amount, status, date
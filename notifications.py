@@ -0,0 +1,274 @@
+# Customer notifications for Code Yatra Bank
+#
+# Usage: python notifications.py [--once] [--workers N] [--batch-size N]
+#
+# Transfers, credits/debits and request decisions queue their emails as rows
+# in the outbox collection, with one insert on the request path and no mail
+# server involved. Money movements queue theirs in the same transaction as the
+# ledger entry (on a replica set), so a committed entry always has its rows. This dispatcher drains the outbox: it leases due rows in
+# batches (so several dispatchers can run), looks up recipients with one query
+# per batch and sends over a small pool of persistent SMTP connections.
+# Transient failures are retried with exponential backoff, and permanent ones
+# (5xx, refused recipient) are marked failed. Each row's _id is its dedupe key.
+# It is used as the Message-ID too, so a resend after a crash between sending
+# and marking can be collapsed by the receiving side.
+#
+# For local testing, run an SMTP stand-in such as:
+#   python -m aiosmtpd -n -l localhost:1025
+
+import argparse
+import queue
+import smtplib
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from models import User, Request, Notification
+
+BATCH_SIZE = 200
+MAX_WORKERS = 4  # Also the number of pooled SMTP connections
+POLL_INTERVAL = 2
+LEASE_SECONDS = 120
+MAX_ATTEMPTS = 6
+RETRY_BASE_SECONDS = 30  # 30s, 1m, 2m, 4m, 8m
+SMTP_TIMEOUT = 30
+SMTP_IDLE_CHECK = 30  # Seconds a pooled connection may sit idle before it is NOOP-checked
+
+
+def init_app(app):
+    """Default mail settings; override in app.config"""
+    app.config.setdefault('MAIL_SERVER', 'localhost')
+    app.config.setdefault('MAIL_PORT', 1025)
+    app.config.setdefault('MAIL_USE_TLS', False)
+    app.config.setdefault('MAIL_USERNAME', None)
+    app.config.setdefault('MAIL_PASSWORD', None)
+    app.config.setdefault('MAIL_SENDER', 'Code Yatra Bank <no-reply@codeyatra.bank>')
+
+
+# --- Write side: called from utils on the request path ---
+
+def _inr(amount):
+    return f"INR {amount:,.2f}"
+
+
+def notify_transfer(txn, session=None, credit=True):
+    """Debit advice for the sender and, if `credit`, credit advice for the recipient of a transfer"""
+    key = f"txn:{txn.inserted_id}"
+    rows = [
+        Notification.build(f"{key}:debit", txn.sender_account, 'transfer_debit',
+                           f"{_inr(txn.amount)} sent to A/c {txn.receiver_account}",
+                           f"{_inr(txn.amount)} was transferred from your account to A/c {txn.receiver_account}.\n"
+                           f"Available balance: {_inr(txn.balance_after_transaction)}.")
+    ]
+    if credit:
+        rows.append(Notification.build(f"{key}:credit", txn.receiver_account, 'transfer_credit',
+                                       f"{_inr(txn.amount)} received from A/c {txn.sender_account}",
+                                       f"{_inr(txn.amount)} was credited to your account from A/c {txn.sender_account}."))
+    return Notification.enqueue(rows, session=session)
+
+
+def notify_cash(txn, session=None):
+    """Advice for an admin credit or debit"""
+    if txn.txn_type == 'credit':
+        account_no, subject = txn.receiver_account, f"{_inr(txn.amount)} credited to your account"
+    else:
+        account_no, subject = txn.sender_account, f"{_inr(txn.amount)} debited from your account"
+    return Notification.enqueue([
+        Notification.build(f"txn:{txn.inserted_id}", account_no, f"cash_{txn.txn_type}", subject,
+                           f"{subject} ({txn.method}).\nAvailable balance: {_inr(txn.balance_after_transaction)}.")
+    ], session=session)
+
+
+def notify_request_decisions(batch_id):
+    """One message per request changed by a Request.transition call"""
+    return Notification.enqueue([
+        Notification.build(f"request:{req['req_id']}:{req['status']}", req['acc_no'], f"request_{req['status']}",
+                           f"Your {req['type']} request was {req['status']}",
+                           f"Your {req['type']} request (ID {req['req_id']}) was {req['status']}.")
+        for req in Request.find_by_batch(batch_id)
+    ])
+
+
+# --- Delivery side ---
+
+class SMTPPool:
+    """Fixed-size pool of persistent SMTP connections, opened lazily"""
+
+    def __init__(self, host, port, size, use_tls=False, username=None, password=None):
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls
+        self.username = username
+        self.password = password
+        self.idle = queue.LifoQueue()
+        for _ in range(size):
+            self.idle.put((None, 0.0))
+
+    def _connect(self):
+        conn = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+        if self.use_tls:
+            conn.starttls()
+        if self.username:
+            conn.login(self.username, self.password)
+        return conn
+
+    def _usable(self, conn, last_used):
+        if conn is None:
+            return False
+        if time.monotonic() - last_used < SMTP_IDLE_CHECK:
+            return True
+        try:
+            return conn.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+
+    def send(self, messages):
+        """Send messages over one pooled connection. Returns [(message, error or None)]."""
+        conn, last_used = self.idle.get()
+        results = []
+        try:
+            if not self._usable(conn, last_used):
+                self._close(conn)
+                conn = None
+                conn = self._connect()
+            for message in messages:
+                try:
+                    conn.send_message(message)
+                    results.append((message, None))
+                except smtplib.SMTPServerDisconnected:
+                    # Reconnect once, then let the rest of the batch fail over to a retry
+                    conn = self._connect()
+                    conn.send_message(message)
+                    results.append((message, None))
+                except smtplib.SMTPException as e:
+                    results.append((message, e))
+        except (smtplib.SMTPException, OSError) as e:
+            self._close(conn)
+            conn = None
+            done = len(results)
+            results.extend((message, e) for message in messages[done:])
+        finally:
+            self.idle.put((conn, time.monotonic()))
+        return results
+
+    @staticmethod
+    def _close(conn):
+        if conn is not None:
+            try:
+                conn.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+
+    def close(self):
+        while not self.idle.empty():
+            conn, _ = self.idle.get()
+            self._close(conn)
+
+
+def is_permanent(error):
+    """5xx replies and refused recipients will not succeed on retry"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    code = getattr(error, 'smtp_code', None)
+    return code is not None and 500 <= code < 600
+
+
+class Dispatcher:
+    def __init__(self, app, workers=MAX_WORKERS, batch_size=BATCH_SIZE):
+        self.app = app
+        self.workers = workers
+        self.batch_size = batch_size
+        self.sender = app.config['MAIL_SENDER']
+        self.pool = SMTPPool(
+            app.config['MAIL_SERVER'], app.config['MAIL_PORT'], workers,
+            use_tls=app.config['MAIL_USE_TLS'],
+            username=app.config['MAIL_USERNAME'],
+            password=app.config['MAIL_PASSWORD']
+        )
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.results = {'sent': 0, 'retry': 0, 'failed': 0}
+
+    def _message(self, row, contact):
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = f"{contact.get('name', '')} <{contact['email']}>"
+        message['Subject'] = row['subject']
+        # ':' is not allowed in a msg-id, so the key's separators become '.'
+        message['Message-ID'] = f"<{row['_id'].replace(':', '.')}@codeyatra.bank>"
+        message.set_content(f"Dear {contact.get('name', 'Customer')},\n\n{row['body']}\n\n- Code Yatra Bank")
+        return message
+
+    def run_once(self):
+        """Send one leased batch. Returns how many rows were processed."""
+        with self.app.app_context():
+            now = datetime.utcnow()
+            rows = Notification.claim_batch(self.batch_size, now, LEASE_SECONDS)
+            if not rows:
+                return 0
+            contacts = User.contacts_for({row['account_no'] for row in rows})
+
+            messages, rows_by_message = [], {}
+            for row in rows:
+                contact = contacts.get(row['account_no'])
+                if not contact or not contact.get('email'):
+                    Notification.mark_failed(row['_id'], 'no email address')
+                    self.results['failed'] += 1
+                    continue
+                message = self._message(row, contact)
+                messages.append(message)
+                rows_by_message[id(message)] = row
+
+            # One slice per pooled connection
+            slices = [messages[i::self.workers] for i in range(self.workers) if messages[i::self.workers]]
+            sent = []
+            for results in self.executor.map(self.pool.send, slices):
+                for message, error in results:
+                    row = rows_by_message[id(message)]
+                    if error is None:
+                        sent.append(row['_id'])
+                    elif is_permanent(error) or row.get('attempts', 0) + 1 >= MAX_ATTEMPTS:
+                        Notification.mark_failed(row['_id'], str(error))
+                        self.results['failed'] += 1
+                    else:
+                        delay = RETRY_BASE_SECONDS * 2 ** row.get('attempts', 0)
+                        Notification.mark_retry(row['_id'], now + timedelta(seconds=delay), str(error))
+                        self.results['retry'] += 1
+            Notification.mark_sent(sent, datetime.utcnow())
+            self.results['sent'] += len(sent)
+        return len(rows)
+
+    def run_forever(self):
+        while True:
+            if self.run_once() < self.batch_size:
+                time.sleep(POLL_INTERVAL)
+
+    def close(self):
+        self.executor.shutdown()
+        self.pool.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Deliver queued customer notifications.')
+    parser.add_argument('--once', action='store_true', help='Drain what is due now and exit')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS, help='Parallel SMTP connections')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    from app import app
+    dispatcher = Dispatcher(app, args.workers, args.batch_size)
+    try:
+        if args.once:
+            while dispatcher.run_once() >= args.batch_size:
+                pass
+            print(f"Outbox drained: {dispatcher.results}")
+        else:
+            dispatcher.run_forever()
+    finally:
+        dispatcher.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,315 @@
+# Ledger reconciliation for Code Yatra Bank
+#
+# Usage: python reconcile.py [--workers N] [--batch-size N] [--output report.json] [--backfill-opening-balances]
+#
+# Streams the transactions ledger in large cursor batches, parses account
+# numbers to integer keys, factorizes them per batch with np.unique and sums net
+# flow per account with np.bincount. The
+# result is compared against users.balance - users.opening_balance, and every
+# account that does not agree is written to a discrepancy report.
+# With --workers > 1 the account space is split into ranges, one process each.
+#
+# Accounts created before opening_balance was stored have no baseline to check
+# against. They are listed separately as unbaselined, with the opening balance
+# the ledger implies, and do not count as discrepancies. Run once with
+# --backfill-opening-balances to store the implied value, ideally while no
+# money is moving; an account whose balance changed since it was read is left
+# for the next run.
+
+import argparse
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from pymongo import MongoClient, UpdateOne
+
+from ledger_router import ledger_collections
+
+DEFAULT_URI = "mongodb://localhost:27017/codeyatra_bank"
+DEFAULT_BATCH_SIZE = 200000
+TOLERANCE = 0.005  # Half a paisa
+ACCOUNT_NO_WIDTH = 10
+NON_ACCOUNTS = ('admin',)  # Counterparties that are not customer accounts
+
+
+class FlowAccumulator:
+    """
+    Net flow per account, grown batch by batch. Account numbers of ACCOUNT_NO_WIDTH digits
+    are parsed to int64 keys and factorized per batch with np.unique; anything else
+    ('admin', malformed numbers) goes through np.unique on strings, which sees few values.
+    """
+    COMPACT_AT = 8000000  # Buffered (key, flow) pairs before they are reduced
+
+    def __init__(self):
+        self._keys = []
+        self._flows = []
+        self._pending = 0
+        self.other = {}  # Non-numeric account -> net flow
+
+    def add_batch(self, senders, receivers, amounts):
+        amounts = np.asarray(amounts, dtype=np.float64)
+        flows = np.concatenate([-amounts, amounts])
+        accounts = senders + receivers
+        try:
+            raw = np.array(accounts, dtype='S')
+        except UnicodeEncodeError:
+            # Blank out the non-ASCII values; as non-numeric they take the string path below
+            raw = np.array([a if a.isascii() else '' for a in accounts], dtype='S')
+        if raw.dtype.itemsize >= ACCOUNT_NO_WIDTH:
+            numeric, keys = _parse_account_numbers(raw)
+        else:
+            numeric, keys = np.zeros(len(accounts), dtype=bool), np.zeros(0, dtype=np.int64)
+        if numeric.any():
+            uniques, inverse = np.unique(keys[numeric], return_inverse=True)
+            self._keys.append(uniques)
+            self._flows.append(np.bincount(inverse.ravel(), weights=flows[numeric], minlength=len(uniques)))
+            self._pending += len(uniques)
+        if not numeric.all():
+            rest = np.asarray(accounts, dtype=str)[~numeric]
+            uniques, inverse = np.unique(rest, return_inverse=True)
+            sums = np.bincount(inverse.ravel(), weights=flows[~numeric], minlength=len(uniques))
+            for account, flow in zip(uniques.tolist(), sums.tolist()):
+                self.other[account] = self.other.get(account, 0.0) + flow
+        if self._pending > self.COMPACT_AT:
+            self._compact()
+
+    def _compact(self):
+        """Reduce the buffered per-batch sums to one sorted key array"""
+        if len(self._keys) > 1:
+            uniques, inverse = np.unique(np.concatenate(self._keys), return_inverse=True)
+            self._flows = [np.bincount(inverse.ravel(), weights=np.concatenate(self._flows), minlength=len(uniques))]
+            self._keys = [uniques]
+        self._pending = len(self._keys[0]) if self._keys else 0
+
+    def totals(self):
+        """(account numbers, net flows) as arrays in the same order"""
+        self._compact()
+        keys = self._keys[0] if self._keys else np.zeros(0, dtype=np.int64)
+        net = self._flows[0] if self._flows else np.zeros(0)
+        # Back to zero-padded strings digit by digit, without a Python call per account
+        chars = (keys[:, None] // _DIGIT_WEIGHTS % 10 + ord('0')).astype(np.uint8)
+        accounts = chars.view(f'S{ACCOUNT_NO_WIDTH}').ravel().astype(str)
+        other = np.array(list(self.other), dtype=str)
+        return np.concatenate([accounts, other]), np.concatenate([net, np.fromiter(self.other.values(), dtype=np.float64, count=len(self.other))])
+
+
+_DIGIT_WEIGHTS = 10 ** np.arange(ACCOUNT_NO_WIDTH - 1, -1, -1, dtype=np.int64)
+
+
+def _parse_account_numbers(raw):
+    """(mask of ACCOUNT_NO_WIDTH-digit entries, their int64 values) for a fixed-width bytes array"""
+    width = raw.dtype.itemsize
+    chars = raw.view(np.uint8).reshape(-1, width)
+    digits = chars[:, :ACCOUNT_NO_WIDTH] - np.uint8(ord('0'))  # Non-digits wrap around to >= 10
+    numeric = (digits < 10).all(axis=1)
+    if width > ACCOUNT_NO_WIDTH:
+        numeric &= (chars[:, ACCOUNT_NO_WIDTH:] == 0).all(axis=1)
+    return numeric, digits.astype(np.int64) @ _DIGIT_WEIGHTS
+
+
+def stream_ledger(db, accumulator, batch_size=DEFAULT_BATCH_SIZE, query=None):
+    """Feed every successful ledger entry matching `query` into the accumulator. Returns rows read."""
+    match = {'status': 'success'}
+    if query:
+        match.update(query)
+    collections = ledger_collections(db)
+    if len(collections) > 1:
+        match['mirror'] = {'$ne': True}  # Partitioned ledger: count each entry's primary copy only
+    rows = 0
+    senders, receivers, amounts = [], [], []
+    for collection in collections:
+        cursor = collection.find(
+            match,
+            projection={'_id': 0, 'sender_account': 1, 'receiver_account': 1, 'amount': 1},
+            batch_size=batch_size
+        )
+        for txn in cursor:
+            senders.append(txn.get('sender_account') or '')
+            receivers.append(txn.get('receiver_account') or '')
+            amounts.append(txn.get('amount', 0.0))
+            if len(amounts) >= batch_size:
+                accumulator.add_batch(senders, receivers, amounts)
+                rows += len(amounts)
+                senders, receivers, amounts = [], [], []
+    if amounts:
+        accumulator.add_batch(senders, receivers, amounts)
+        rows += len(amounts)
+    return rows
+
+
+def load_balances(db, batch_size=DEFAULT_BATCH_SIZE, query=None):
+    """Return {account_no: (balance, opening_balance or None)}"""
+    balances = {}
+    cursor = db.users.find(
+        query or {},
+        projection={'_id': 0, 'account_no': 1, 'balance': 1, 'opening_balance': 1},
+        batch_size=batch_size
+    )
+    for user in cursor:
+        balances[user['account_no']] = (user.get('balance', 0.0), user.get('opening_balance'))
+    return balances
+
+
+def compare(accounts, net, balances):
+    """Compare ledger net flows against stored balances. Returns (discrepancies, unbaselined accounts)."""
+    ledger_net = dict(zip(accounts.tolist(), np.round(net, 2).tolist()))
+    discrepancies = []
+    unbaselined = []
+    for account_no in sorted(set(ledger_net) | set(balances)):
+        if account_no in NON_ACCOUNTS:
+            continue
+        flow = ledger_net.get(account_no, 0.0)
+        if account_no not in balances:
+            discrepancies.append({
+                'account_no': account_no,
+                'issue': 'missing_user',
+                'ledger_net': flow
+            })
+            continue
+        balance, opening = balances[account_no]
+        if opening is None:
+            # Created before opening balances were stored: nothing to check against until backfilled
+            unbaselined.append({
+                'account_no': account_no,
+                'balance': balance,
+                'ledger_net': flow,
+                'implied_opening_balance': round(balance - flow, 2)
+            })
+            continue
+        difference = round(balance - (opening + flow), 2)
+        if abs(difference) > TOLERANCE:
+            discrepancies.append({
+                'account_no': account_no,
+                'issue': 'mismatch',
+                'balance': balance,
+                'opening_balance': opening,
+                'ledger_net': flow,
+                'difference': difference
+            })
+    return discrepancies, unbaselined
+
+
+def backfill_opening_balances(db, unbaselined):
+    """Store the implied opening balance of accounts that have none. Returns how many were set."""
+    operations = [UpdateOne(
+        # The balance filter skips accounts that moved money since they were read
+        {'account_no': u['account_no'], 'opening_balance': {'$exists': False}, 'balance': u['balance']},
+        {'$set': {'opening_balance': u['implied_opening_balance']}}
+    ) for u in unbaselined]
+    if not operations:
+        return 0
+    return db.users.bulk_write(operations, ordered=False).modified_count
+
+
+def account_ranges(workers):
+    """
+    Split the account number space into `workers` contiguous string ranges.
+    Bounds are evenly spaced over 10-digit numbers, but the first range starts at ''
+    and the last is open-ended, so malformed account numbers are still covered.
+    """
+    top = 10 ** ACCOUNT_NO_WIDTH
+    bounds = [top * i // workers for i in range(workers + 1)]
+    ranges = []
+    for i in range(workers):
+        lo = str(bounds[i]).zfill(ACCOUNT_NO_WIDTH) if i > 0 else ''
+        hi = str(bounds[i + 1]).zfill(ACCOUNT_NO_WIDTH) if i + 1 < workers else None
+        ranges.append((lo, hi))
+    return ranges
+
+
+def _range_query(field, lo, hi):
+    cond = {'$gte': lo}
+    if hi is not None:
+        cond['$lt'] = hi
+    return {field: cond}
+
+
+def _in_range(account_no, lo, hi):
+    return account_no >= lo and (hi is None or account_no < hi)
+
+
+def reconcile_range(uri, lo, hi, batch_size=DEFAULT_BATCH_SIZE):
+    """Reconcile the accounts in [lo, hi). Runs in a worker process with its own client."""
+    client = MongoClient(uri)
+    try:
+        db = client.get_default_database()
+        accumulator = FlowAccumulator()
+        rows = stream_ledger(db, accumulator, batch_size, {'$or': [
+            _range_query('sender_account', lo, hi),
+            _range_query('receiver_account', lo, hi)
+        ]})
+        balances = load_balances(db, batch_size, _range_query('account_no', lo, hi))
+    finally:
+        client.close()
+    accounts, net = accumulator.totals()
+    # Rows were fetched for either side being in range; keep only the in-range side
+    keep = np.fromiter((_in_range(a, lo, hi) for a in accounts), dtype=bool, count=len(accounts))
+    return rows, compare(accounts[keep], net[keep], balances)
+
+
+def reconcile(uri=DEFAULT_URI, workers=1, batch_size=DEFAULT_BATCH_SIZE):
+    """Reconcile the whole bank. Returns (ledger rows read, discrepancies, unbaselined) sorted by account."""
+    if workers <= 1:
+        client = MongoClient(uri)
+        try:
+            db = client.get_default_database()
+            accumulator = FlowAccumulator()
+            rows = stream_ledger(db, accumulator, batch_size)
+            balances = load_balances(db, batch_size)
+        finally:
+            client.close()
+        return (rows,) + compare(*accumulator.totals(), balances)
+
+    rows = 0
+    discrepancies = []
+    unbaselined = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(reconcile_range, uri, lo, hi, batch_size) for lo, hi in account_ranges(workers)]
+        for future in futures:
+            # A transfer between two ranges is read by both workers, so this overcounts
+            part_rows, (part, part_unbaselined) = future.result()
+            rows += part_rows
+            discrepancies.extend(part)
+            unbaselined.extend(part_unbaselined)
+    discrepancies.sort(key=lambda d: d['account_no'])
+    unbaselined.sort(key=lambda d: d['account_no'])
+    return rows, discrepancies, unbaselined
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reconcile user balances against the transaction ledger.')
+    parser.add_argument('--uri', default=DEFAULT_URI)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    parser.add_argument('--backfill-opening-balances', action='store_true',
+                        help='Store the ledger-implied opening balance for accounts that have none')
+    args = parser.parse_args(argv)
+
+    rows, discrepancies, unbaselined = reconcile(args.uri, args.workers, args.batch_size)
+    report = {
+        'ledger_rows': rows,
+        'discrepancy_count': len(discrepancies),
+        'discrepancies': discrepancies,
+        'unbaselined_count': len(unbaselined),
+        'unbaselined': unbaselined
+    }
+    if args.backfill_opening_balances:
+        client = MongoClient(args.uri)
+        try:
+            report['backfilled'] = backfill_opening_balances(client.get_default_database(), unbaselined)
+        finally:
+            client.close()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    print(f"Reconciled {rows} ledger entries: {len(discrepancies)} discrepancies, {len(unbaselined)} accounts without an opening balance", file=sys.stderr)
+    return 1 if discrepancies else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+# Standing instruction scheduler for Code Yatra Bank
+#
+# Usage: python scheduler.py [--once] [--concurrency N] [--batch-size N] [--rate N]
+#
+# Polls standing_instructions for due entries in batches (earliest next_run
+# first, served from a heap), leases each one atomically so several scheduler
+# processes can run side by side, and executes it through transfer_money with
+# an idempotency key per attempt. Concurrency and transfers per second are
+# capped so month-start bursts do not crowd out interactive traffic.
+# Failed attempts (insufficient funds, velocity limits) are retried with
+# exponential backoff; every attempt is logged to standing_instruction_runs.
+
+import argparse
+import calendar
+import heapq
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from models import User, StandingInstruction
+from utils import transfer_money
+
+MAX_CONCURRENCY = 4
+BATCH_SIZE = 500
+MAX_RATE = 100  # Transfers started per second, per scheduler process
+POLL_INTERVAL = 5
+LEASE_SECONDS = 300
+MAX_RETRIES = 3
+RETRY_BASE_SECONDS = 15 * 60  # 15 min, then 30, then 60
+
+
+def next_occurrence(current, frequency, anchor_day):
+    """The run after `current`. Monthly runs keep the anchor day, clamped to the month's length."""
+    if frequency == 'daily':
+        return current + timedelta(days=1)
+    if frequency == 'weekly':
+        return current + timedelta(weeks=1)
+    year, month = (current.year + 1, 1) if current.month == 12 else (current.year, current.month + 1)
+    day = min(anchor_day, calendar.monthrange(year, month)[1])
+    return current.replace(year=year, month=month, day=day)
+
+
+def execute(si, now):
+    """Run one leased instruction and schedule its next run. Returns the result string."""
+    due = si['next_run']
+    attempt = si.get('attempt', 0)
+    key = f"si:{si['si_id']}:{due.isoformat()}"
+    outcome = transfer_money(si['sender_account'], si['recipient_account'], si['amount'], idempotency_key=key)
+
+    if outcome is None:
+        # Another worker is still running this exact attempt; leave the lease to expire
+        return 'in_progress'
+    if outcome:
+        result = 'success'
+    else:
+        sender = User.find_by_account_no(si['sender_account'])
+        result = 'insufficient_funds' if sender and sender.balance < si['amount'] else 'failed'
+
+    status = 'active'
+    period = si.get('scheduled_for') or due
+    # Failures may be transient (balance, velocity limits), so they get the same backoff
+    if result != 'success' and attempt < MAX_RETRIES:
+        next_run = now + timedelta(seconds=RETRY_BASE_SECONDS * 2 ** attempt)
+        next_attempt = attempt + 1
+    else:
+        # Success, or retries used up: move on to the next period.
+        # A period missed while the scheduler was down is already due and runs next poll.
+        anchor_day = (si.get('first_run') or period).day
+        period = next_occurrence(period, si['frequency'], anchor_day)
+        next_run = period
+        next_attempt = 0
+        if si.get('end_date') and period > si['end_date']:
+            status = 'completed'
+
+    StandingInstruction.log_run(si['si_id'], due, attempt, result, key)
+    StandingInstruction.finish(si['si_id'], next_run, period, next_attempt, status, result, now)
+    return result
+
+
+class Scheduler:
+    def __init__(self, app, concurrency=MAX_CONCURRENCY, batch_size=BATCH_SIZE, rate=MAX_RATE):
+        self.app = app
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.min_interval = 1.0 / rate if rate else 0.0
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.results = {}
+        self._results_lock = threading.Lock()
+
+    def _run_one(self, si_id):
+        try:
+            with self.app.app_context():
+                now = datetime.utcnow()
+                si = StandingInstruction.claim(si_id, now, LEASE_SECONDS)
+                result = execute(si, now) if si else 'skipped'
+            with self._results_lock:
+                self.results[result] = self.results.get(result, 0) + 1
+        finally:
+            self.slots.release()
+
+    def run_once(self):
+        """Execute everything due right now. Returns how many instructions were dispatched."""
+        with self.app.app_context():
+            due = StandingInstruction.find_due(datetime.utcnow(), self.batch_size)
+        heap = [(si['next_run'], si['si_id']) for si in due]
+        heapq.heapify(heap)
+        dispatched = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            while heap:
+                _, si_id = heapq.heappop(heap)
+                self.slots.acquire()
+                pool.submit(self._run_one, si_id)
+                dispatched += 1
+                if self.min_interval:
+                    time.sleep(self.min_interval)
+        return dispatched
+
+    def run_forever(self):
+        while True:
+            # Keep draining while full batches come back; otherwise wait for the next poll
+            if self.run_once() < self.batch_size:
+                time.sleep(POLL_INTERVAL)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Execute due standing instructions.')
+    parser.add_argument('--once', action='store_true', help='Drain what is due now and exit')
+    parser.add_argument('--concurrency', type=int, default=MAX_CONCURRENCY)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--rate', type=float, default=MAX_RATE, help='Max transfers started per second')
+    args = parser.parse_args(argv)
+
+    from app import app
+    scheduler = Scheduler(app, args.concurrency, args.batch_size, args.rate)
+    if args.once:
+        total = 0
+        while True:
+            dispatched = scheduler.run_once()
+            total += dispatched
+            if dispatched < args.batch_size:
+                break
+        print(f"Dispatched {total} standing instructions: {scheduler.results}")
+    else:
+        scheduler.run_forever()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
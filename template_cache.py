@@ -0,0 +1,135 @@
+# Template caching for Code Yatra Bank
+#
+# - Jinja bytecode cache on disk, so new workers skip recompiling templates.
+# - {% cache 'name', key, ... %}...{% endcache %} fragment cache tag, held in a
+#   size-bounded LRU. Keys must change whenever the fragment's data changes
+#   (the transaction pages use account number + latest transaction _id).
+# - gzip compression of large HTML responses.
+
+import gzip
+import os
+import threading
+from collections import OrderedDict
+
+from flask import request
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+
+FRAGMENT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered fragments, bounded by total characters held"""
+
+    def __init__(self, max_bytes=FRAGMENT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FragmentCacheExtension(Extension):
+    """Adds the {% cache key, ... %}...{% endcache %} tag"""
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=FragmentCache())
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key_parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key_parts.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render_cached', [nodes.List(key_parts)]), [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, key_parts, caller):
+        key = tuple(str(part) for part in key_parts)
+        cached = self.environment.fragment_cache.get(key)
+        if cached is None:
+            cached = caller()
+            self.environment.fragment_cache.set(key, cached)
+        return cached
+
+
+class LazyRows:
+    """
+    Iterable that runs its loader only when a template actually iterates it,
+    so a fragment cache hit skips the database query as well as the rendering.
+    """
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._rows = None
+
+    def _load(self):
+        if self._rows is None:
+            self._rows = self._loader()
+        return self._rows
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __bool__(self):
+        return bool(self._load())
+
+
+def gzip_response(response):
+    """Compress large HTML responses for clients that accept gzip"""
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or response.mimetype != 'text/html'
+            or 'Content-Encoding' in response.headers
+            or 'gzip' not in request.headers.get('Accept-Encoding', '')):
+        return response
+    data = response.get_data()
+    if len(data) < GZIP_MIN_SIZE:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=GZIP_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def init_app(app):
+    """Enable the bytecode cache, the {% cache %} tag and gzip compression"""
+    # Jinja executes what it loads from here, so the default is private to the app, not a shared /tmp path
+    cache_dir = app.config.get('JINJA_BYTECODE_CACHE_DIR') or os.path.join(app.instance_path, 'jinja_cache')
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.after_request(gzip_response)
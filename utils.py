@@ -1,59 +1,147 @@
 # Utility functions for Code Yatra Bank
 
-from models import User, Transaction, Request, QRTransfer
+from datetime import datetime
+from models import User, Transaction, Request, QRTransfer, IdempotencyKey
+from db import supports_transactions, run_in_transaction
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+import velocity
+import notifications
 
-def transfer_money(sender_acc, recipient_acc, amount):
+TAKEN_OVER = object()  # _replay_transfer result: this request now owns an abandoned key
+
+def transfer_money(sender_acc, recipient_acc, amount, idempotency_key=None):
     """
     Handle user-to-user money transfer.
     Validates sender balance, updates balances, and logs transactions.
     Returns True if successful, False otherwise.
-    """
+    When an idempotency key is given, a retried request returns the original
+    result without moving money again, or None while the original is still running
+    or its outcome cannot be known yet.
+    """
+    if idempotency_key:
+        existing = IdempotencyKey.reserve(idempotency_key, sender_acc)
+        if existing:
+            replayed = _replay_transfer(existing, sender_acc)
+            if replayed is not TAKEN_OVER:
+                return replayed
+
+    try:
+        result = _execute_transfer(sender_acc, recipient_acc, amount, idempotency_key)
+    except DuplicateKeyError:
+        if not idempotency_key:
+            raise
+        # A request with the same key committed its ledger entry first (only possible after a takeover)
+        return True
+
+    if idempotency_key and result is None:
+        IdempotencyKey.complete(idempotency_key, False)
+    return result is not None
+
+def _execute_transfer(sender_acc, recipient_acc, amount, idempotency_key=None):
+    """Move the money and write the ledger entry. Returns the Transaction or None."""
     sender = User.find_by_account_no(sender_acc)
     recipient = User.find_by_account_no(recipient_acc)
 
     if not sender or not recipient:
-        return False
+        return None
 
     if sender.balance < amount:
+        return None
+
+    # Velocity and fraud rules run last; the transfer is counted now and uncounted if no money moves
+    reason, hold = velocity.engine.hold(sender_acc, recipient_acc, amount)
+    if reason:
+        return None
+
+    def move_money(session=None):
+        # Deduct from sender; fails if a concurrent debit got there first
+        if not sender.update_balance(-amount, session=session):
+            return None
+        # Add to recipient
+        recipient.update_balance(amount, session=session)
+        # Log only one transaction record with updated balances
+        txn = Transaction.record_transaction(sender_acc, recipient_acc, amount, 'transfer', method='Transfer', balance_after=sender.balance, idempotency_key=idempotency_key, session=session)
+        notifications.notify_transfer(txn, session=session)
+        if idempotency_key:
+            IdempotencyKey.complete(idempotency_key, True, txn.transaction_id, session=session)
+        return txn
+
+    # On a replica set both balances, the ledger entry, its notifications and the key commit together
+    return _with_hold(hold, move_money)
+
+def _with_hold(hold, move_money):
+    """Run move_money atomically, releasing the velocity hold if it fails or moves nothing"""
+    try:
+        result = _atomically(move_money)
+    except Exception:
+        velocity.engine.release(hold)
+        raise
+    if not result:
+        velocity.engine.release(hold)
+    return result
+
+def _atomically(fn):
+    """fn(session) inside a transaction where the deployment supports one, else fn() directly"""
+    return run_in_transaction(fn) if supports_transactions() else fn()
+
+def _replay_transfer(record, sender_acc):
+    """
+    Return the stored result for a key that was already used, None while its outcome
+    is unknown, or TAKEN_OVER if its request died and this one may run it again
+    """
+    if record.get('account_no') != sender_acc:
         return False
-
-    # Deduct from sender
-    sender.update_balance(-amount)
-    # Add to recipient
-    recipient.update_balance(amount)
-
-    # Refresh sender balance from DB after update
-    sender = User.find_by_account_no(sender_acc)
-    # Refresh recipient balance from DB after update
-    recipient = User.find_by_account_no(recipient_acc)
-
-    # Log only one transaction record with updated balances
-    Transaction.record_transaction(sender_acc, recipient_acc, amount, 'transfer', method='Transfer', balance_after=sender.balance)
-
-    return True
+    if record.get('status') == 'completed':
+        return record.get('result')
+    # The ledger entry carries the key, so a pending record whose ledger write
+    # already landed was completed by a request that died before acknowledging.
+    txn = Transaction.find_by_idempotency_key(record['key'], sender_acc)
+    if txn:
+        IdempotencyKey.complete(record['key'], True, txn.get('transaction_id'))
+        return True
+    now = datetime.utcnow()
+    if not IdempotencyKey.lease_expired(record, now):
+        return None
+    if supports_transactions():
+        # The key is completed in the same transaction that moves the money, so nothing moved
+        return TAKEN_OVER if IdempotencyKey.take_over(record['key'], now) else None
+    # Without transactions the request may still be running, or may have died after
+    # debiting the sender, so neither answer is safe; reconcile.py reports a balance
+    # left without a ledger entry. The key stays pending until it expires.
+    return None
 
 def credit_user(account_no, amount):
     """
     Credit amount to user's account (admin function).
     """
     user = User.find_by_account_no(account_no)
-    if user:
-        user.update_balance(amount)
-        Transaction.record_transaction('admin', account_no, amount, 'credit', method='Cash Submit in Bank', balance_after=user.balance)
+    if not user:
+        return False
+
+    def post(session=None):
+        if not user.update_balance(amount, session=session):
+            return False
+        txn = Transaction.record_transaction('admin', account_no, amount, 'credit', method='Cash Submit in Bank', balance_after=user.balance, session=session)
+        notifications.notify_cash(txn, session=session)
         return True
-    return False
+    return _atomically(post)
 
 def debit_user(account_no, amount):
     """
     Debit amount from user's account (admin function).
     """
     user = User.find_by_account_no(account_no)
-    if user and user.balance >= amount:
-        user.update_balance(-amount)
-        Transaction.record_transaction(account_no, 'admin', amount, 'debit', method='Cash', balance_after=user.balance)
+    if not user or user.balance < amount:
+        return False
+
+    def post(session=None):
+        if not user.update_balance(-amount, session=session):
+            return False
+        txn = Transaction.record_transaction(account_no, 'admin', amount, 'debit', method='Cash', balance_after=user.balance, session=session)
+        notifications.notify_cash(txn, session=session)
         return True
-    return False
+    return _atomically(post)
 
 def submit_request(account_no, request_type):
     """
@@ -63,25 +151,44 @@ def submit_request(account_no, request_type):
 
 def approve_request(req_id):
     """
-    Approve a request.
+    Approve a request. Only pending requests can be approved.
     """
-    req_data = Request.find_by_id(req_id)
-    if req_data:
-        req = Request(req_data['req_id'], req_data['acc_no'], req_data['type'], req_data['status'], req_data['created_at'])
-        req.update_status('approved')
-        return True
-    return False
+    return approve_requests([req_id]) == 1
 
 def reject_request(req_id):
     """
-    Reject a request.
+    Reject a request. Only pending requests can be rejected.
     """
-    req_data = Request.find_by_id(req_id)
-    if req_data:
-        req = Request(req_data['req_id'], req_data['acc_no'], req_data['type'], req_data['status'], req_data['created_at'])
-        req.update_status('rejected')
-        return True
-    return False
+    return reject_requests([req_id]) == 1
+
+def approve_requests(req_ids):
+    """
+    Approve many pending requests at once. Returns the number approved.
+    """
+    return _decide_requests(req_ids, 'approved')
+
+def reject_requests(req_ids):
+    """
+    Reject many pending requests at once. Returns the number rejected.
+    """
+    return _decide_requests(req_ids, 'rejected')
+
+def decide_all_pending(status):
+    """
+    Approve or reject every pending request. Returns the number changed.
+    """
+    return _decide_requests(None, status)
+
+def _decide_requests(req_ids, status):
+    """Transition requests (all pending ones if req_ids is None) and queue a notification for each one changed"""
+    batch_id = ObjectId()
+    if req_ids is None:
+        changed = Request.transition_all_pending(status, batch_id)
+    else:
+        changed = Request.transition(req_ids, status, batch_id)
+    if changed:
+        notifications.notify_request_decisions(batch_id)
+    return changed
 
 def qr_transfer(sender_acc, receiver_acc, amount):
     """
@@ -92,16 +199,27 @@ def qr_transfer(sender_acc, receiver_acc, amount):
     if not sender or sender.balance < amount:
         return False
 
-    # Deduct and add
-    sender.update_balance(-amount)
+    reason, hold = velocity.engine.hold(sender_acc, receiver_acc, amount)
+    if reason:
+        return False
+
     recipient = User.find_by_account_no(receiver_acc)
-    if recipient:
-        recipient.update_balance(amount)
 
+    def move_money(session=None):
+        # Deduct and add
+        if not sender.update_balance(-amount, session=session):
+            return False
+        if recipient:
+            recipient.update_balance(amount, session=session)
+        # Log transactions; only an existing recipient gets a credit advice
+        txn = Transaction.record_transaction(sender_acc, receiver_acc, amount, 'transfer', session=session)
+        notifications.notify_transfer(txn, session=session, credit=recipient is not None)
+        return True
+
+    if not _with_hold(hold, move_money):
+        return False
     # Log QR transfer
     QRTransfer.simulate_qr_transfer(sender_acc, receiver_acc, amount)
-    # Log transactions
-    Transaction.record_transaction(sender_acc, receiver_acc, amount, 'transfer')
     return True
 
 def mask_aadhar(aadhar):
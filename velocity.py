@@ -0,0 +1,279 @@
+# Velocity and fraud checks for Code Yatra Bank transfers
+#
+# Every sending account gets per-minute, per-hour and per-day sliding windows of
+# transfer count and amount, kept in fixed-size ring buffers so both checking and
+# recording are O(1). Rules are small objects with a check() method; the engine
+# runs them in order and rejects the transfer on the first failure.
+# State lives in memory and is rebuilt from recent transactions on startup.
+# Windows exist only for accounts that sent in the last day and are evicted,
+# oldest first, once idle that long; other senders keep just a tuple of the
+# recipients they have paid, for the new-recipient rule.
+
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from models import Transaction
+
+EPOCH = datetime(1970, 1, 1)
+
+# Default limits
+DAILY_LIMIT = 200000.0
+BURST_MAX_PER_MINUTE = 5
+BURST_MAX_PER_HOUR = 30
+NEW_RECIPIENT_MAX_AMOUNT = 25000.0
+RECIPIENT_HISTORY_DAYS = 180
+# Windows untouched for this long are empty and are dropped
+IDLE_SECONDS = 86400
+
+
+def to_epoch(ts):
+    """Naive UTC datetime (as stored in transaction_time.timestamp) -> epoch seconds"""
+    return (ts - EPOCH).total_seconds()
+
+
+class SlidingWindow:
+    """
+    Count and sum of events over the last `span` seconds, in `buckets` slots.
+    Expiry is per bucket, so the window edge is accurate to span / buckets.
+    """
+    __slots__ = ('width', 'size', 'counts', 'sums', 'head', 'count', 'total')
+
+    def __init__(self, span, buckets):
+        self.width = span / buckets
+        self.size = buckets
+        self.counts = array('l', [0]) * buckets
+        self.sums = array('d', [0.0]) * buckets
+        self.head = 0  # Absolute bucket number of the newest slot
+        self.count = 0
+        self.total = 0.0
+
+    def advance(self, now):
+        """Expire buckets that fell out of the window. Amortized O(1)."""
+        slot = int(now // self.width)
+        if slot <= self.head:
+            return
+        if self.count == 0:
+            # Nothing to expire; also drops accumulated float error in the total
+            self.head = slot
+            self.total = 0.0
+            return
+        if slot - self.head >= self.size:
+            self.counts = array('l', [0]) * self.size
+            self.sums = array('d', [0.0]) * self.size
+            self.count = 0
+            self.total = 0.0
+            self.head = slot
+            return
+        for step in range(1, slot - self.head + 1):
+            i = (self.head + step) % self.size
+            self.count -= self.counts[i]
+            self.total -= self.sums[i]
+            self.counts[i] = 0
+            self.sums[i] = 0.0
+        self.head = slot
+        if self.count == 0:
+            self.total = 0.0
+
+    def remove(self, at, amount):
+        """Take back an event recorded at `at`, unless it has already expired"""
+        slot = int(at // self.width)
+        if slot <= self.head - self.size or slot > self.head:
+            return
+        i = slot % self.size
+        if self.counts[i] == 0:
+            return
+        self.counts[i] -= 1
+        self.sums[i] -= amount
+        self.count -= 1
+        self.total -= amount
+        if self.count == 0:
+            self.total = 0.0
+
+    def add(self, now, amount):
+        """Record one event. Events older than the window are ignored."""
+        self.advance(now)
+        slot = int(now // self.width)
+        if slot <= self.head - self.size:
+            return
+        i = slot % self.size
+        self.counts[i] += 1
+        self.sums[i] += amount
+        self.count += 1
+        self.total += amount
+
+
+class AccountVelocity:
+    """Sliding windows and known recipients for one sending account"""
+    __slots__ = ('minute', 'hour', 'day', 'recipients', 'last_seen')
+
+    def __init__(self, recipients=()):
+        self.minute = SlidingWindow(60, 60)
+        self.hour = SlidingWindow(3600, 60)
+        self.day = SlidingWindow(86400, 96)
+        self.recipients = set(recipients)
+        self.last_seen = 0.0
+
+    def advance(self, now):
+        self.minute.advance(now)
+        self.hour.advance(now)
+        self.day.advance(now)
+
+    def record(self, now, recipient, amount):
+        self.last_seen = max(self.last_seen, now)
+        self.minute.add(now, amount)
+        self.hour.add(now, amount)
+        self.day.add(now, amount)
+        self.recipients.add(recipient)
+
+    def unrecord(self, at, amount):
+        self.minute.remove(at, amount)
+        self.hour.remove(at, amount)
+        self.day.remove(at, amount)
+
+
+class Hold:
+    """A transfer counted in its sender's windows before the money moved, so it can be taken back"""
+    __slots__ = ('sender', 'recipient', 'amount', 'at', 'new_recipient')
+
+    def __init__(self, sender, recipient, amount, at, new_recipient):
+        self.sender = sender
+        self.recipient = recipient
+        self.amount = amount
+        self.at = at
+        self.new_recipient = new_recipient
+
+
+class DailyLimitRule:
+    """Total sent over the last 24 hours may not exceed `limit`"""
+
+    def __init__(self, limit=DAILY_LIMIT):
+        self.limit = limit
+
+    def check(self, state, recipient, amount):
+        if state.day.total + amount > self.limit:
+            return 'daily transfer limit exceeded'
+        return None
+
+
+class BurstCountRule:
+    """At most `max_count` transfers within the given window ('minute' or 'hour')"""
+
+    def __init__(self, window='minute', max_count=BURST_MAX_PER_MINUTE):
+        self.window = window
+        self.max_count = max_count
+
+    def check(self, state, recipient, amount):
+        if getattr(state, self.window).count >= self.max_count:
+            return f'too many transfers in the last {self.window}'
+        return None
+
+
+class NewRecipientCapRule:
+    """The first transfer to a recipient may not exceed `max_amount`"""
+
+    def __init__(self, max_amount=NEW_RECIPIENT_MAX_AMOUNT):
+        self.max_amount = max_amount
+
+    def check(self, state, recipient, amount):
+        if recipient not in state.recipients and amount > self.max_amount:
+            return 'amount too high for a new recipient'
+        return None
+
+
+def default_rules():
+    return [
+        BurstCountRule('minute', BURST_MAX_PER_MINUTE),
+        BurstCountRule('hour', BURST_MAX_PER_HOUR),
+        DailyLimitRule(DAILY_LIMIT),
+        NewRecipientCapRule(NEW_RECIPIENT_MAX_AMOUNT),
+    ]
+
+
+class VelocityEngine:
+    """Runs pre-transfer rules against per-account sliding windows"""
+
+    def __init__(self, rules=None):
+        self.rules = rules if rules is not None else default_rules()
+        self.accounts = OrderedDict()  # Active senders, least recently seen first
+        self.recipients = {}  # Idle senders -> tuple of recipients
+        self._lock = threading.Lock()
+
+    def _state(self, account_no, now):
+        state = self.accounts.get(account_no)
+        if state is None:
+            state = self.accounts[account_no] = AccountVelocity(self.recipients.pop(account_no, ()))
+        else:
+            self.accounts.move_to_end(account_no)
+        state.last_seen = max(state.last_seen, now)
+        return state
+
+    def _evict_idle(self, now):
+        """Drop windows idle for IDLE_SECONDS (they are empty), keeping their recipients"""
+        accounts = self.accounts
+        while accounts:
+            account_no, state = next(iter(accounts.items()))
+            if now - state.last_seen < IDLE_SECONDS:
+                break
+            del accounts[account_no]
+            self.recipients[account_no] = tuple(state.recipients)
+
+    def hold(self, sender_acc, recipient_acc, amount, now=None):
+        """
+        Check a transfer against every rule and, if it passes, count it provisionally.
+        Returns (None, Hold) when allowed, otherwise (reason, None). Counting in the same
+        step keeps concurrent transfers from all passing against the same totals; pass
+        the Hold to release() if the money then does not move.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._evict_idle(now)
+            state = self._state(sender_acc, now)
+            state.advance(now)
+            for rule in self.rules:
+                reason = rule.check(state, recipient_acc, amount)
+                if reason:
+                    return reason, None
+            new_recipient = recipient_acc not in state.recipients
+            state.record(now, recipient_acc, amount)
+        return None, Hold(sender_acc, recipient_acc, amount, now, new_recipient)
+
+    def release(self, hold):
+        """Uncount a held transfer that did not go through"""
+        with self._lock:
+            state = self.accounts.get(hold.sender)
+            if state is None:
+                return  # Evicted, so its windows had already emptied
+            state.unrecord(hold.at, hold.amount)
+            if hold.new_recipient:
+                state.recipients.discard(hold.recipient)
+
+    def authorize(self, sender_acc, recipient_acc, amount, now=None):
+        """hold() for callers that never release. Returns None when allowed, otherwise the reason."""
+        return self.hold(sender_acc, recipient_acc, amount, now)[0]
+
+    def rebuild(self, now=None):
+        """Reload windows from the last day of transfers and recipients from recent history. Returns the senders known."""
+        now = time.time() if now is None else now
+        now_dt = EPOCH + timedelta(seconds=now)
+        history = {sender: tuple(recipients) for sender, recipients in
+                   Transaction.recipients_by_sender_since(now_dt - timedelta(days=RECIPIENT_HISTORY_DAYS))}
+        accounts = OrderedDict()
+        # Oldest first, so the dict ends up ordered by last transfer like a live engine
+        for txn in Transaction.find_transfers_since(now_dt - timedelta(seconds=IDLE_SECONDS)):
+            sender = txn['sender_account']
+            state = accounts.get(sender)
+            if state is None:
+                state = accounts[sender] = AccountVelocity(history.pop(sender, ()))
+            else:
+                accounts.move_to_end(sender)
+            state.record(to_epoch(txn['transaction_time']['timestamp']), txn['receiver_account'], txn['amount'])
+        with self._lock:
+            self.accounts = accounts
+            self.recipients = history
+        return len(accounts) + len(history)
+
+
+engine = VelocityEngine()